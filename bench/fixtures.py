@@ -0,0 +1,80 @@
+"""基准测试用的合成样本：全部在本地生成，不依赖外部书籍"""
+
+import os
+import zipfile
+
+import pymupdf as fitz
+
+_PARAGRAPH = (
+    "The quick brown fox jumps over the lazy dog. 敏捷的棕色狐狸跳过了懒狗。"
+    "Pack my box with five dozen liquor jugs. 电子书解析服务基准测试样本文本。"
+)
+
+
+def text_pdf(path: str, pages: int) -> str:
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(page.rect + (50, 50, -50, -50),
+                            f"Page {i + 1}\n" + (_PARAGRAPH + "\n") * 12, fontsize=10)
+    doc.set_toc([[1, f"Chapter {p // 10 + 1}", p + 1] for p in range(0, pages, 10)])
+    doc.save(path)
+    return path
+
+
+def image_pdf(path: str, pages: int) -> str:
+    """只有图像、没有文本层的 PDF（模拟扫描件）"""
+    src = fitz.open()
+    page = src.new_page()
+    page.insert_textbox(page.rect + (50, 50, -50, -50), (_PARAGRAPH + "\n") * 8, fontsize=12)
+    pix = page.get_pixmap(matrix=fitz.Matrix(2, 2), colorspace="gray", alpha=False)
+    doc = fitz.open()
+    for _ in range(pages):
+        doc.new_page().insert_image(fitz.Rect(0, 0, 595, 842), pixmap=pix)
+    doc.save(path)
+    return path
+
+
+def epub(path: str, chapters: int) -> str:
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        zf.writestr('META-INF/container.xml', (
+            '<?xml version="1.0"?><container version="1.0" '
+            'xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+            '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+            '</rootfiles></container>'))
+        items, refs = [], []
+        for c in range(chapters):
+            name = f'ch{c + 1}.xhtml'
+            body = ''.join(f'<p>{_PARAGRAPH}</p>' for _ in range(40))
+            zf.writestr(f'OEBPS/{name}', (
+                '<?xml version="1.0" encoding="utf-8"?><html xmlns="http://www.w3.org/1999/xhtml">'
+                f'<head><title>Chapter {c + 1}</title></head><body><h1>Chapter {c + 1}</h1>{body}</body></html>'))
+            items.append(f'<item id="c{c}" href="{name}" media-type="application/xhtml+xml"/>')
+            refs.append(f'<itemref idref="c{c}"/>')
+        zf.writestr('OEBPS/content.opf', (
+            '<?xml version="1.0"?><package xmlns="http://www.idpf.org/2007/opf" version="3.0">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>Bench</dc:title></metadata>'
+            f'<manifest>{"".join(items)}</manifest><spine>{"".join(refs)}</spine></package>'))
+    return path
+
+
+def large_txt(path: str, megabytes: int) -> str:
+    line = (_PARAGRAPH + "\n").encode('utf-8')
+    target = megabytes * 1024 * 1024
+    with open(path, 'wb') as f:
+        written = 0
+        while written < target:
+            f.write(line * 1000)
+            written += len(line) * 1000
+    return path
+
+
+def build_all(directory: str, scale: float = 1.0) -> dict:
+    os.makedirs(directory, exist_ok=True)
+    return {
+        'text_pdf': text_pdf(os.path.join(directory, 'text.pdf'), max(10, int(200 * scale))),
+        'image_pdf': image_pdf(os.path.join(directory, 'scan.pdf'), max(2, int(20 * scale))),
+        'epub': epub(os.path.join(directory, 'book.epub'), max(3, int(30 * scale))),
+        'txt': large_txt(os.path.join(directory, 'novel.txt'), max(1, int(50 * scale))),
+    }
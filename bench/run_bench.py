@@ -0,0 +1,312 @@
+"""
+提取与 OCR 热路径的可复现基准测试
+
+用法:
+    python bench/run_bench.py                      # 运行全部场景，与 bench/baseline.json 比较
+    python bench/run_bench.py --save-baseline      # 将本次结果保存为基线
+    python bench/run_bench.py --only parse_txt ocr_stages --scale 0.2
+
+每个场景在独立子进程中运行（缓存目录隔离，峰值 RSS 互不影响）。结果写入 JSON；
+与基线相比耗时/内存增加超过 --tolerance（或吞吐下降超过该比例）时以退出码 1 结束。
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+BENCH = os.path.dirname(os.path.abspath(__file__))
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 if sys.platform != 'darwin' else peak / 1024 / 1024, 1)
+
+
+def _has_tesseract():
+    return shutil.which('tesseract') is not None
+
+
+def _time_parse(parser, path, start, end, use_ocr=False):
+    t0 = time.perf_counter()
+    parser.parse_range(path, start, end, use_ocr)
+    return time.perf_counter() - t0
+
+
+def bench_parse(fixture, path, workers, use_ocr=False):
+    """冷启动（空缓存）、内存缓存命中、磁盘页缓存命中三种情况下的整书解析"""
+    from core.ebook_parser import EbookParser
+
+    parser = EbookParser(workers=workers)
+    pages = parser.parse_range(path, 1, None, use_ocr).count('=== Page ')
+    parser.close()
+    # 上面一次用于统计页数并预热磁盘缓存，冷启动改用新的缓存目录重测
+    os.environ['READBOOKS_CACHE_DIR'] = tempfile.mkdtemp(prefix='bench-cold-')
+    parser = EbookParser(workers=workers)
+    cold = _time_parse(parser, path, 1, None, use_ocr)
+    warm_memory = _time_parse(parser, path, 1, None, use_ocr)
+    parser.close()
+    parser = EbookParser(workers=workers)
+    warm_disk = _time_parse(parser, path, 1, None, use_ocr)
+    parser.close()
+    return {
+        'pages': pages,
+        'cold_s': round(cold, 4),
+        'cold_ms_per_page': round(cold / pages * 1000, 3),
+        'warm_memory_s': round(warm_memory, 5),
+        'warm_disk_s': round(warm_disk, 4),
+        'warm_disk_ms_per_page': round(warm_disk / pages * 1000, 3),
+    }
+
+
+def bench_txt_random_page(path):
+    """大 TXT 的索引构建与单页随机读取延迟"""
+    from core.txt_index import TxtIndex
+
+    index = TxtIndex()
+    t0 = time.perf_counter()
+    total = index.page_count(path)
+    build = time.perf_counter() - t0
+    samples = [1, total // 2, total]
+    t0 = time.perf_counter()
+    for _ in range(20):
+        for page in samples:
+            index.read_page(path, page)
+    read = (time.perf_counter() - t0) / (20 * len(samples))
+    return {'pages': total, 'index_build_s': round(build, 4), 'page_read_ms': round(read * 1000, 4)}
+
+
+def bench_ocr_stages(path, rounds):
+    """OCRProcessor 各阶段耗时；未安装 tesseract 时只测预处理阶段"""
+    import pymupdf as fitz
+    from core.ocr_engine import OCRProcessor
+
+    ocr = OCRProcessor()
+    with fitz.open(path) as doc:
+        pix = doc[0].get_pixmap(matrix=fitz.Matrix(300 / 72, 300 / 72),
+                                colorspace="rgb" if ocr.needs_color else "gray", alpha=False)
+    full = _has_tesseract()
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        if full:
+            ocr.process(pix, lang='eng')
+        else:
+            with ocr._timed('normalize'):
+                image = ocr._normalize_input(pix)
+            ocr._enhance_image(image)
+    elapsed = time.perf_counter() - t0
+    result = {
+        'backend': ocr.backend.name,
+        'preset': ocr.preset,
+        'full_ocr': full,
+        'images_per_s': round(rounds / elapsed, 3),
+    }
+    for stage, stat in ocr.stage_timings().items():
+        result[f'{stage}_ms'] = round(stat['avg'] * 1000, 3)
+    return result
+
+
+def bench_mcp_stdio(txt_path):
+    """stdio 模式端到端：启动到 initialize 完成、list_tools、一次 parse_ebook 调用"""
+    import asyncio
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+
+    params = StdioServerParameters(
+        command=sys.executable,
+        args=[os.path.join(SRC, 'readbooks_server.py'), '--mode', 'stdio'],
+        env={**os.environ, 'PYTHONPATH': SRC, 'PYTHONIOENCODING': 'utf-8'},
+    )
+
+    async def run():
+        t0 = time.perf_counter()
+        async with stdio_client(params) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                initialized = time.perf_counter() - t0
+                t1 = time.perf_counter()
+                await session.list_tools()
+                listed = time.perf_counter() - t1
+                t2 = time.perf_counter()
+                await session.call_tool('parse_ebook', {'file_path': txt_path, 'start_page': 1, 'end_page': 2})
+                called = time.perf_counter() - t2
+        return {
+            'startup_to_initialize_s': round(initialized, 4),
+            'list_tools_ms': round(listed * 1000, 3),
+            'parse_call_ms': round(called * 1000, 3),
+        }
+
+    return asyncio.run(run())
+
+
+def _scenarios(fixtures, args):
+    scenarios = {
+        'parse_text_pdf': (bench_parse, ('text_pdf', fixtures['text_pdf'], args.workers)),
+        'parse_epub': (bench_parse, ('epub', fixtures['epub'], args.workers)),
+        'parse_txt': (bench_parse, ('txt', fixtures['txt'], args.workers)),
+        'txt_random_page': (bench_txt_random_page, (fixtures['txt'],)),
+        'ocr_stages': (bench_ocr_stages, (fixtures['image_pdf'], args.ocr_rounds)),
+        'mcp_stdio': (bench_mcp_stdio, (fixtures['txt'],)),
+    }
+    if _has_tesseract():
+        scenarios['parse_image_pdf_ocr'] = (bench_parse, ('image_pdf', fixtures['image_pdf'], args.workers, True))
+    return scenarios
+
+
+def _child(name, func, func_args, queue):
+    sys.path.insert(0, SRC)
+    os.environ['READBOOKS_CACHE_DIR'] = tempfile.mkdtemp(prefix=f'bench-{name}-')
+    try:
+        # 屏蔽被测代码的标准输出，避免干扰结果
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func(*func_args)
+        result['peak_rss_mb'] = _peak_rss_mb()
+        queue.put((name, result, None))
+    except Exception as e:
+        queue.put((name, None, f'{type(e).__name__}: {e}'))
+
+
+def run_scenario(name, func, func_args, repeat=1):
+    """重复运行 repeat 次，数值指标取中位数"""
+    ctx = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeat):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_child, args=(name, func, func_args, queue))
+        proc.start()
+        _, result, error = queue.get()
+        proc.join()
+        if error:
+            return None, error
+        runs.append(result)
+    merged = dict(runs[0])
+    for metric, value in merged.items():
+        if metric != 'pages' and isinstance(value, (int, float)) and not isinstance(value, bool):
+            merged[metric] = round(statistics.median(run[metric] for run in runs), 5)
+    return merged, None
+
+
+# 绝对差值低于该噪声下限的变化不计为回归
+_NOISE_FLOOR = {'_ms': 0.5, '_s': 0.005, '_mb': 5.0, '_per_s': 0.0}
+
+
+def _higher_is_better(metric):
+    return metric.endswith('_per_s')
+
+
+def _noise_floor(metric):
+    for suffix in ('_per_s', '_ms', '_s', '_mb'):
+        if metric.endswith(suffix):
+            return _NOISE_FLOOR[suffix]
+    return 0.0
+
+
+def compare(results, baseline, tolerance):
+    """返回回归列表 [(场景, 指标, 基线, 当前)]"""
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get('results', {}).get(name) or {}
+        for metric, value in metrics.items():
+            old = base.get(metric)
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or not old:
+                continue
+            if metric == 'pages' or abs(value - old) < _noise_floor(metric):
+                continue
+            if _higher_is_better(metric):
+                worse = value < old * (1 - tolerance)
+            else:
+                worse = value > old * (1 + tolerance)
+            if worse:
+                regressions.append((name, metric, old, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=1.0, help='样本规模系数')
+    parser.add_argument('--workers', type=int, default=1, help='EbookParser 并行进程数')
+    parser.add_argument('--ocr-rounds', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3, help='每个场景重复次数，取中位数')
+    parser.add_argument('--only', nargs='*', help='只运行指定场景')
+    parser.add_argument('--output', default=os.path.join(BENCH, 'results.json'))
+    parser.add_argument('--baseline', default=os.path.join(BENCH, 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的性能回退比例')
+    args = parser.parse_args()
+
+    sys.path.insert(0, BENCH)
+    import fixtures as fixture_builder
+
+    fixture_dir = tempfile.mkdtemp(prefix='bench-fixtures-')
+    try:
+        fixtures = fixture_builder.build_all(fixture_dir, args.scale)
+        results, errors = {}, {}
+        for name, (func, func_args) in _scenarios(fixtures, args).items():
+            if args.only and name not in args.only:
+                continue
+            print(f'running {name} ...', flush=True)
+            result, error = run_scenario(name, func, func_args, args.repeat)
+            if error:
+                errors[name] = error
+                print(f'  failed: {error}')
+            else:
+                results[name] = result
+                print('  ' + json.dumps(result, ensure_ascii=False))
+    finally:
+        shutil.rmtree(fixture_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'scale': args.scale,
+            'workers': args.workers,
+            'repeat': args.repeat,
+        },
+        'results': results,
+        'errors': errors,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'results written to {args.output}')
+
+    # 场景崩溃同样算失败，也不能据此保存基线
+    if errors:
+        print(f'FAILED scenarios: {", ".join(sorted(errors))}')
+        return 1
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'baseline saved to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print('no baseline found; run with --save-baseline to create one')
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('meta', {}).get('scale') != args.scale:
+        print('warning: baseline was recorded with a different --scale')
+    regressions = compare(results, baseline, args.tolerance)
+    for name, metric, old, new in regressions:
+        print(f'REGRESSION {name}.{metric}: {old} -> {new}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
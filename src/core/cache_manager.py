@@ -1,21 +1,100 @@
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import OrderedDict
+
 
 class CacheManager:
-    def __init__(self, max_size=100, ttl=3600):
-        self.cache = {}
+    """线程安全的 LRU 缓存：条目数与字节双重上限，TTL 惰性+定期清理"""
+
+    def __init__(self, max_size=100, ttl=3600, max_bytes=64 * 1024 * 1024, sweep_interval=60):
+        self.cache = OrderedDict()  # key -> (data, 过期时刻, 字节数)
         self.max_size = max_size
-        self.ttl = timedelta(seconds=ttl)
-        
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._lock = threading.RLock()
+        self._last_sweep = time.monotonic()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
     def get(self, key: str):
-        entry = self.cache.get(key)
-        if entry and datetime.now() - entry['timestamp'] < self.ttl:
-            return entry['data']
-        return None
-        
+        with self._lock:
+            now = time.monotonic()
+            self._maybe_sweep(now)
+            entry = self.cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[1] <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
     def set(self, key: str, data: str):
-        if len(self.cache) >= self.max_size:
-            self.cache.pop(next(iter(self.cache)))
-        self.cache[key] = {
-            'data': data,
-            'timestamp': datetime.now()
-        }
\ No newline at end of file
+        size = len(data.encode('utf-8')) if isinstance(data, str) else len(data)
+        if size > self.max_bytes:
+            # 超过整体预算的条目不缓存，避免清空整个缓存
+            return
+        with self._lock:
+            now = time.monotonic()
+            if key in self.cache:
+                self._remove(key)
+            self.cache[key] = (data, now + self.ttl, size)
+            self.bytes += size
+            self._maybe_sweep(now)
+            while len(self.cache) > self.max_size or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.cache)))
+                self.evictions += 1
+
+    def sweep(self) -> int:
+        """清除全部过期条目，返回清除数量"""
+        with self._lock:
+            now = time.monotonic()
+            self._last_sweep = now
+            expired = [k for k, entry in self.cache.items() if entry[1] <= now]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+            return len(expired)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.cache),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def invalidate_prefix(self, prefix: str) -> int:
+        """删除键以 prefix 开头的条目（如某本书的全部范围），返回删除数量"""
+        with self._lock:
+            keys = [key for key in self.cache if key.startswith(prefix)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self.cache.clear()
+            self.bytes = 0
+
+    def _maybe_sweep(self, now: float):
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def _remove(self, key: str):
+        entry = self.cache.pop(key)
+        self.bytes -= entry[2]
@@ -0,0 +1,94 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from utils.metrics import metrics
+
+
+class DocumentPool:
+    """已打开文档句柄池（LRU淘汰，按路径+mtime/size失效）"""
+
+    def __init__(self, max_size: int = 8):
+        self.max_size = max_size
+        self._docs = OrderedDict()  # path -> {'stamp', 'doc', 'lock', 'users'}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stamp(path: str):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    @contextmanager
+    def open(self, path: str):
+        """借出文档句柄，持有期间独占该句柄"""
+        entry = self._checkout(path)
+        try:
+            with entry['lock']:
+                yield entry['doc']
+        finally:
+            self._checkin(path, entry)
+
+    def _checkout(self, path: str) -> dict:
+        path = os.path.abspath(path)
+        stamp = self._stamp(path)
+        with self._lock:
+            entry = self._docs.get(path)
+            if entry and entry['stamp'] == stamp:
+                self._docs.move_to_end(path)
+                entry['users'] += 1
+                metrics.cache_result('doc_pool', True)
+                return entry
+            if entry:
+                # 文件已变更，旧句柄在无人使用时关闭
+                self._retire(path, entry)
+
+        metrics.cache_result('doc_pool', False)
+        import pymupdf as fitz  # 延迟导入，加快服务启动
+        with metrics.span('doc_open'):
+            doc = fitz.open(path)
+        with self._lock:
+            current = self._docs.get(path)
+            if current and current['stamp'] == stamp:
+                # 并发打开时以先入池者为准
+                doc.close()
+                self._docs.move_to_end(path)
+                current['users'] += 1
+                return current
+            if current:
+                self._retire(path, current)
+            entry = {'stamp': stamp, 'doc': doc, 'lock': threading.Lock(),
+                     'users': 1, 'retired': False}
+            self._docs[path] = entry
+            self._evict()
+            return entry
+
+    def _checkin(self, path: str, entry: dict):
+        with self._lock:
+            entry['users'] -= 1
+            if entry['retired'] and entry['users'] == 0:
+                entry['doc'].close()
+
+    def _retire(self, path: str, entry: dict):
+        """移出池；仍被借用的句柄推迟到归还时关闭"""
+        if self._docs.get(path) is entry:
+            del self._docs[path]
+        entry['retired'] = True
+        if entry['users'] == 0:
+            entry['doc'].close()
+
+    def _evict(self):
+        while len(self._docs) > self.max_size:
+            path, entry = next(iter(self._docs.items()))
+            self._retire(path, entry)
+
+    def invalidate(self, path: str):
+        with self._lock:
+            entry = self._docs.get(os.path.abspath(path))
+            if entry:
+                self._retire(os.path.abspath(path), entry)
+
+    def close_all(self):
+        with self._lock:
+            for path, entry in list(self._docs.items()):
+                self._retire(path, entry)
@@ -1,77 +1,609 @@
-import fitz
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
 from pathlib import Path
-from typing import Optional
-from core.ocr_engine import OCRProcessor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from core.cache_manager import CacheManager
+from core.document_pool import DocumentPool
+from core.txt_index import TxtIndex
+from core.page_cache import PageCache
+from core.native_extractors import NativeExtractor
+from core.epub_layout import EpubLayout
+from core.search_index import SearchIndex
+from core.metadata_store import MetadataStore
+from core.prefetcher import ReadAheadPrefetcher
 from utils.file_convert import convert_to_pdf
 from utils.file_convert import convert_ebook
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# pymupdf、OpenCV、tesseract 等重量级依赖在首次用到时才导入，服务冷启动不受其影响。
+# 注意使用 pymupdf 模块名：旧的 fitz 模块名导入时会向 stdout 打印弃用警告
+
+class ParseCancelledError(RuntimeError):
+    """解析任务被取消（客户端断开、取消或超时）"""
+
+
+class FailedPage(str):
+    """提取失败或 OCR 降级的页内容：照常返回给调用方，但不写入页缓存与全文索引，下次读取时重试"""
+
+
+# 工作进程内的解析器实例，各自持有文档句柄池
+_worker_parser = None
+
+
+def _init_worker():
+    global _worker_parser
+    _worker_parser = EbookParser(workers=1)
+
+
+def _parse_pages_worker(ext: str, path: str, pages: List[int], use_ocr: bool) -> Dict[int, str]:
+    return _worker_parser._parse_pages(ext, path, pages, use_ocr)
+
 
 class EbookParser:
-    def __init__(self):
-        self.cache = CacheManager()
-        self.ocr = OCRProcessor()
+    # 提取逻辑变化影响页内容或页码时递增，使旧的页缓存失效
+    EXTRACT_VERSION = 5
+
+    def __init__(self, workers: Optional[int] = None):
+        self.cache = CacheManager(
+            max_size=int(os.getenv('RANGE_CACHE_MAX_ENTRIES', 100)),
+            ttl=int(os.getenv('RANGE_CACHE_TTL', 3600)),
+            max_bytes=int(float(os.getenv('RANGE_CACHE_MAX_MB', 64)) * 1024 * 1024)
+        )
+        self._ocr = None
+        self._ocr_planner = None
+        self._lazy_lock = threading.Lock()
+        # 图像识别结果：键为 预设+语言+识别模式+图像摘要（或渲染结果摘要）+DPI，
+        # 重复出现的图像（页眉 logo 等）只识别一次
+        self.ocr_results = CacheManager(
+            max_size=int(os.getenv('OCR_RESULT_CACHE_SIZE', 2048)),
+            ttl=int(os.getenv('RANGE_CACHE_TTL', 3600)),
+            max_bytes=16 * 1024 * 1024
+        )
+        self.docs = DocumentPool(max_size=int(os.getenv('DOC_POOL_SIZE', 8)))
+        self.txt_index = TxtIndex()
+        self.page_cache = PageCache()
+        self.native = NativeExtractor()
+        self.epub = EpubLayout()
+        self.search_index = SearchIndex()
+        self.metadata = MetadataStore()
+        # 并行解析配置：workers<=1 时始终串行
+        self.workers = workers or int(os.getenv('PARSE_WORKERS') or 0) or os.cpu_count() or 1
+        self.parallel_min_pages = int(os.getenv('PARALLEL_MIN_PAGES', 16))
+        # 逐页读取时新提取的页攒够一批再写入页缓存
+        self.cache_write_batch = int(os.getenv('PAGE_CACHE_WRITE_BATCH', 16))
+        # 书籍信息的逐页类型最多实际分类这么多页（均匀抽样），0 表示逐页分类
+        self.book_info_sample_pages = int(os.getenv('BOOK_INFO_SAMPLE_PAGES', 200))
+        self._pool = None
+        # 前台读取计数，预读线程据此让路
+        self.active_reads = 0
+        self._reads_lock = threading.Lock()
+        self.prefetcher = ReadAheadPrefetcher(self)
     
+    @property
+    def ocr(self):
+        """OCR 处理器（连同 OpenCV/NumPy/OCR 引擎）在第一次需要识别时才创建"""
+        if self._ocr is None:
+            with self._lazy_lock:
+                if self._ocr is None:
+                    from core.ocr_engine import OCRProcessor
+                    self._ocr = OCRProcessor()
+        return self._ocr
+
+    @property
+    def ocr_planner(self):
+        if self._ocr_planner is None:
+            from core.ocr_planner import OCRPlanner
+            self._ocr_planner = OCRPlanner()
+        return self._ocr_planner
+
+    def warmup(self) -> List[str]:
+        """预先导入各格式与 OCR 的依赖并创建 OCR 引擎，返回已加载的模块名（供常驻部署使用）"""
+        import pymupdf  # noqa: F401
+        loaded = ['pymupdf']
+        try:
+            self.ocr
+            self.ocr_planner
+            loaded.append(f'ocr:{self.ocr.backend.name}')
+        except Exception as e:
+            logger.warning(f"OCR 引擎预加载失败: {str(e)}")
+        for ext in NativeExtractor.EXTENSIONS:
+            if self.native.supports(ext):
+                loaded.append(ext.lstrip('.'))
+        return loaded
+
     def parse_range(self, file_path: str, 
                    start_page: int, end_page: Optional[int],
-                   use_ocr: bool) -> str:
+                   use_ocr: bool,
+                   cancel_event: Optional[threading.Event] = None) -> str:
+        book = self._open_book(file_path, use_ocr)
+        if book is None:
+            return ""
+        total = book['total']
+        end = end_page or total
+        
+        # 页码有效性校验
+        if start_page < 1 or end > total or start_page > end:
+            raise ValueError(f"无效的页码范围 (1-{total})")
+        
+        # 缓存检查
+        cache_key = self._range_key(book, start_page, end)
+        with metrics.span('cache_lookup', cache='range'):
+            cached = self.cache.get(cache_key)
+        metrics.cache_result('range', cached is not None)
+        if cached:
+            return cached
+            
+        content = []
+        failed = False
+        for p, page_content in self._iter_book(book, start_page, end, use_ocr, cancel_event):
+            content.append(f"=== Page {p}/{total} ===\n{page_content}")
+            failed = failed or isinstance(page_content, FailedPage)
+        if len(content) < end - start_page + 1:
+            return ""
+        
+        result = "\n".join(content)
+        if not failed:
+            self.cache.set(cache_key, result)
+        return result
+
+    def iter_pages(self, file_path: str, start_page: int, end_page: Optional[int],
+                   use_ocr: bool,
+                   cancel_event: Optional[threading.Event] = None) -> Iterator[Tuple[int, int, str]]:
+        """按页生成 (页码, 总页数, 内容)，内存占用与书的大小无关"""
+        book = self._open_book(file_path, use_ocr)
+        if book is None:
+            return
+        total = book['total']
+        end = end_page or total
+        if start_page < 1 or end > total or start_page > end:
+            raise ValueError(f"无效的页码范围 (1-{total})")
+        for p, page_content in self._iter_book(book, start_page, end, use_ocr, cancel_event):
+            yield p, total, page_content
+
+    def read_chunk(self, file_path: str, start_page: int, end_page: Optional[int],
+                   use_ocr: bool, max_chars: int = 0,
+                   on_page: Optional[Callable[[int, int], None]] = None,
+                   cancel_event: Optional[threading.Event] = None,
+                   client: Optional[str] = None) -> Tuple[str, Optional[int]]:
+        """
+        读取一段页面，累计字符数达到 max_chars 时在页边界截断（至少返回一页）
+
+        返回 (文本, 下一页页码)；已读到末尾时下一页为 None。
+        给出 client 时记录该客户端的阅读位置，顺序阅读时在后台预读下一段
+        """
+        with self._reads_lock:
+            self.active_reads += 1
+        try:
+            text, next_page, last, total = self._read_chunk(
+                file_path, start_page, end_page, use_ocr, max_chars, on_page, cancel_event)
+        finally:
+            with self._reads_lock:
+                self.active_reads -= 1
+        if client is not None and last is not None:
+            self.prefetcher.observe(client, file_path, start_page, last, use_ocr, total)
+        return text, next_page
+
+    def _read_chunk(self, file_path, start_page, end_page, use_ocr, max_chars, on_page, cancel_event):
+        """与 parse_range 共用内存范围缓存：整段读完且无失败页时写入，命中且未超出字符预算时直接返回"""
+        book = self._open_book(file_path, use_ocr)
+        if book is None:
+            return "", None, None, 0
+        total = book['total']
+        end = end_page or total
+        if start_page < 1 or end > total or start_page > end:
+            raise ValueError(f"无效的页码范围 (1-{total})")
+
+        cache_key = self._range_key(book, start_page, end)
+        with metrics.span('cache_lookup', cache='range'):
+            cached = self.cache.get(cache_key)
+        # 单页或整段不超出预算时，逐页截断的结果与整段相同
+        usable = bool(cached) and (not max_chars or len(cached) <= max_chars or start_page == end)
+        metrics.cache_result('range', usable)
+        if usable:
+            if on_page:
+                on_page(end - start_page + 1, end - start_page + 1)
+            return cached, None, end, total
+
+        content = []
+        size = 0
+        last = None
+        failed = False
+        for p, page_content in self._iter_book(book, start_page, end, use_ocr, cancel_event):
+            block = f"=== Page {p}/{total} ===\n{page_content}"
+            if max_chars and content and size + len(block) > max_chars:
+                return "\n".join(content), p, last, total
+            content.append(block)
+            size += len(block) + 1
+            last = p
+            failed = failed or isinstance(page_content, FailedPage)
+            if on_page:
+                on_page(p - start_page + 1, end - start_page + 1)
+        if last is not None and last < end:
+            # 解析中途失败，剩余页从 last+1 继续
+            return "\n".join(content), last + 1, last, total
+        result = "\n".join(content)
+        if last is not None and not failed:
+            self.cache.set(cache_key, result)
+        return result, None, last, total
+
+    @staticmethod
+    def _range_key(book: dict, start: int, end: int) -> str:
+        return f"{book['fingerprint']}-{book['mode']}-{start}-{end}"
+
+    def warm_cache(self, file_path: str, use_ocr: bool,
+                   cancel_event: Optional[threading.Event] = None) -> int:
+        """
+        预先提取整本书写入页缓存，返回新提取的页数
+
+        经 _iter_book 逐批提取并写入，超时或取消时已提取的页保留在缓存中，再次预热从剩余页继续
+        """
+        book = self._open_book(file_path, use_ocr)
+        if book is None:
+            return 0
+        pages = range(1, book['total'] + 1)
+        cached = self.page_cache.get_pages(book['fingerprint'], pages, book['mode'])
+        missing = [p for p in pages if p not in cached]
+        if missing:
+            for _ in self._iter_book(book, missing[0], missing[-1], use_ocr, cancel_event):
+                pass
+        return len(missing)
+
+    def prefetch_range(self, file_path: str, start: int, end: int, use_ocr: bool,
+                       cancel_event: threading.Event,
+                       should_continue: Callable[[int], bool]) -> int:
+        """
+        预读线程调用：逐页提取缺失页写入页缓存，每页之前询问 should_continue(已提取字节数)，
+        返回新提取的页数
+        """
+        book = self._open_book(file_path, use_ocr)
+        if book is None:
+            return 0
+        pages = list(range(start, min(end, book['total']) + 1))
+        cached = self.page_cache.get_pages(book['fingerprint'], pages, book['mode'])
+        fetched, fetched_bytes = 0, 0
+        for p in pages:
+            if p in cached:
+                continue
+            if not should_continue(fetched_bytes):
+                break
+            source = self._book_source(book)
+            if source is None:
+                break
+            try:
+                extracted = self._parse_pages(*source, [p], use_ocr, cancel_event)
+            except ParseCancelledError:
+                break
+            self._store_pages(book, extracted)
+            fetched += 1
+            fetched_bytes += sum(len(text.encode('utf-8')) for text in extracted.values())
+        return fetched
+
+    def index_book(self, file_path: str, use_ocr: bool = False,
+                   cancel_event: Optional[threading.Event] = None) -> int:
+        """后台补全整本书的全文索引，返回新索引的页数"""
+        book = self._open_book(file_path, use_ocr)
+        if book is None:
+            return 0
+        missing = self.search_index.missing_pages(book['fingerprint'], book['total'])
+        batch = max(self.parallel_min_pages, self.workers * 2)
+        for i in range(0, len(missing), batch):
+            pages = missing[i:i + batch]
+            parsed = self.page_cache.get_pages(book['fingerprint'], pages, book['mode'])
+            self.search_index.add_pages(book['fingerprint'], parsed)
+            rest = [p for p in pages if p not in parsed]
+            if rest:
+                source = self._book_source(book)
+                if source is None:
+                    break
+                self._store_pages(book, self._extract_pages(*source, rest, use_ocr, cancel_event))
+        return len(missing)
+
+    def book_info(self, file_path: str,
+                  cancel_event: Optional[threading.Event] = None) -> dict:
+        """
+        书籍元数据：页数、目录、逐页类型（文字/扫描/混合/空白）与文件指纹，结果持久化
+
+        PDF 页数超过 book_info_sample_pages 时只对均匀抽样的页分类，其余页沿用前一个样本页的类型，
+        page_types_sampled 记录实际分类的页数
+        """
+        info = self.metadata.get_info(file_path)
+        if info is not None and info.get('extract_version') == self.EXTRACT_VERSION:
+            return info
+        book = self._open_book(file_path, False)
+        source = self._book_source(book) if book else None
+        if source is None:
+            raise ValueError(f"无法读取文件：{file_path}")
+        ext, path = source
+        toc, types = [], ['text'] * book['total']
+        sampled = book['total']
+        if ext == '.pdf':
+            with self.docs.open(path) as doc:
+                toc = [list(entry[:3]) for entry in doc.get_toc(simple=True)]
+                samples = self._sample_pages(doc.page_count, self.book_info_sample_pages)
+                types, sampled = [], len(samples)
+                for i, index in enumerate(samples):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise ParseCancelledError("获取书籍信息已取消")
+                    end = samples[i + 1] if i + 1 < len(samples) else doc.page_count
+                    types.extend([self._classify_page(doc[index])] * (end - index))
+        elif ext == '.epub':
+            toc = self.epub.toc(path)
+            for page in self.epub.image_pages(path):
+                types[page - 1] = 'scanned'
+        elif ext in NativeExtractor.EXTENSIONS:
+            toc = self.native.toc(path)
+
+        counts = {}
+        for t in types:
+            counts[t] = counts.get(t, 0) + 1
+        info = {
+            'file_path': os.path.abspath(file_path),
+            'format': book['ext'].lstrip('.'),
+            'file_size': os.path.getsize(file_path),
+            'fingerprint': book['fingerprint'],
+            'page_count': book['total'],
+            'toc': toc,
+            'page_type_counts': counts,
+            'page_types': self._run_lengths(types),
+            'page_types_sampled': sampled,
+            'extract_version': self.EXTRACT_VERSION,
+        }
+        self.metadata.put_info(file_path, info)
+        return info
+
+    @staticmethod
+    def _sample_pages(total: int, limit: int) -> List[int]:
+        """均匀抽取不超过 limit 个页序号（从 0 起，含首页）；limit<=0 或页数不超过 limit 时取全部"""
+        if limit <= 0 or total <= limit:
+            return list(range(total))
+        return sorted({i * total // limit for i in range(limit)})
+
+    @staticmethod
+    def _classify_page(pg) -> str:
+        """按文本层字数与图像覆盖率粗分页面类型"""
+        import pymupdf as fitz
+        chars = len(pg.get_text("text").strip())
+        area = abs(pg.rect) or 1
+        covered = 0.0
+        for image in pg.get_image_info():
+            covered += abs(fitz.Rect(image['bbox']) & pg.rect)
+        coverage = min(1.0, covered / area)
+        if chars >= 50:
+            return 'mixed' if coverage >= 0.5 else 'text'
+        if coverage >= 0.3:
+            return 'scanned'
+        return 'mixed' if coverage > 0 else 'empty'
+
+    @staticmethod
+    def _run_lengths(types: List[str]) -> List[dict]:
+        """逐页类型压缩为连续区间 [{'type', 'pages': [起, 止]}]"""
+        runs = []
+        for page, t in enumerate(types, 1):
+            if runs and runs[-1]['type'] == t and runs[-1]['pages'][1] == page - 1:
+                runs[-1]['pages'][1] = page
+            else:
+                runs.append({'type': t, 'pages': [page, page]})
+        return runs
+
+    def search(self, file_path: str, query: str, limit: int = 10) -> dict:
+        """在已建立的索引中检索，返回结果与索引覆盖情况"""
+        book = self._open_book(file_path, False)
+        if book is None:
+            return {'results': [], 'indexed_pages': 0, 'total_pages': 0}
+        fingerprint = book['fingerprint']
+        return {
+            'results': self.search_index.search(fingerprint, query, limit),
+            'indexed_pages': self.search_index.indexed_pages(fingerprint),
+            'total_pages': book['total'],
+        }
+
+    def _store_pages(self, book: dict, extracted: Dict[int, str]):
+        """新提取的页写入页缓存并增量加入全文索引；提取失败的页不写入"""
+        extracted = {p: text for p, text in extracted.items() if not isinstance(text, FailedPage)}
+        if not extracted:
+            return
+        self.page_cache.put_pages(book['fingerprint'], book['mode'], extracted)
+        try:
+            self.search_index.add_pages(book['fingerprint'], extracted)
+        except Exception as e:
+            logger.warning(f"更新全文索引失败: {str(e)}")
+
+    def _open_book(self, file_path: str, use_ocr: bool) -> Optional[dict]:
+        """校验格式并取得总页数；转换后的源文件在需要提取时才准备"""
         ext = Path(file_path).suffix.lower()
         # 修正 strip 方法调用
         if ext.strip() not in ('.pdf', '.doc', '.docx', '.epub', '.mobi', '.chm', '.txt'):
             raise ValueError(f"不支持的格式：{ext}")
-        original_ext = ext
+
+        book = {
+            'path': file_path,
+            'ext': ext,
+            'fingerprint': self.metadata.fingerprint(file_path),
+            'mode': self._cache_mode(use_ocr),
+            'source': None,
+        }
+        total = self.page_cache.get_total(book['fingerprint'], self.EXTRACT_VERSION)
+        if total is None:
+            source = self._book_source(book)
+            if source is None:
+                return None
+            total = self._get_total_pages(*source)
+            self.page_cache.set_total(book['fingerprint'], self.EXTRACT_VERSION, file_path, total)
+        book['total'] = total
+        return book
+
+    def _book_source(self, book: dict) -> Optional[Tuple[str, str]]:
+        if book['source'] is None:
+            book['source'] = self._resolve_source(book['path'], book['ext'])
+        return book['source']
+
+    def _iter_book(self, book: dict, start: int, end: int, use_ocr: bool,
+                   cancel_event: Optional[threading.Event] = None) -> Iterator[Tuple[int, str]]:
+        """
+        分批解析：先取持久化页缓存，只提取缺失页
+
+        页缓存按 cache_write_batch 页一批查询；缺失页的提取批大小兼顾并行度与首字节延迟，
+        串行时逐页提取，读到哪页提取哪页
+        """
+        batch = 1
+        if self.workers > 1 and end - start + 1 >= self.parallel_min_pages:
+            batch = max(self.parallel_min_pages, self.workers * 2)
+        lookup = max(batch, self.cache_write_batch)
+        # 逐页提取时页缓存写入攒批提交；调用方提前停止迭代时在 finally 中写入已提取的页
+        unsaved = {}
+        try:
+            for first in range(start, end + 1, lookup):
+                pages = list(range(first, min(first + lookup, end + 1)))
+                with metrics.span('cache_lookup', cache='page'):
+                    parsed = self.page_cache.get_pages(book['fingerprint'], pages, book['mode'])
+                missing = [p for p in pages if p not in parsed]
+                metrics.inc('readbooks_cache_requests_total', len(parsed), cache='page', result='hit')
+                metrics.inc('readbooks_cache_requests_total', len(missing), cache='page', result='miss')
+                for p in pages:
+                    if p not in parsed:
+                        source = self._book_source(book)
+                        if source is None:
+                            return
+                        todo = missing[missing.index(p):][:batch]
+                        extracted = self._extract_pages(*source, todo, use_ocr, cancel_event)
+                        unsaved.update(extracted)
+                        if len(unsaved) >= self.cache_write_batch:
+                            self._store_pages(book, unsaved)
+                            unsaved = {}
+                        parsed.update(extracted)
+                    yield p, parsed[p]
+        finally:
+            if unsaved:
+                self._store_pages(book, unsaved)
+
+    def purge_cache(self, file_path: str) -> int:
+        """清除该书的全部页缓存、内存范围缓存与全文索引，返回删除的缓存页数"""
+        fingerprint = self.metadata.fingerprint(file_path)
+        self.invalidate_memory(fingerprint)
+        self.search_index.purge(fingerprint)
+        return self.page_cache.purge(fingerprint)
+
+    def invalidate_memory(self, fingerprint: str):
+        """丢弃该书在本进程内存中的范围缓存"""
+        self.cache.invalidate_prefix(f"{fingerprint}-")
+
+    def cache_stats(self) -> dict:
+        """内存范围缓存与持久化页缓存的统计"""
+        return {
+            'range_cache': self.cache.stats(),
+            'page_cache_bytes': self.page_cache.size(),
+            'page_cache_max_bytes': self.page_cache.max_bytes,
+            'prefetch': self.prefetcher.stats(),
+        }
+
+    def _cache_mode(self, use_ocr: bool) -> str:
+        return f"v{self.EXTRACT_VERSION}:{'ocr' if use_ocr else 'text'}"
+
+    def _resolve_source(self, file_path: str, ext: str) -> Optional[Tuple[str, str]]:
+        """需要时转换为可直接解析的格式，返回 (ext, path)"""
+        # DOCX/MOBI/CHM 优先直接读取文本，失败时再走转换流程
+        if self.native.supports(ext):
+            try:
+                self.native.page_count(file_path)
+                return ext, file_path
+            except Exception as e:
+                logger.warning(f"直接读取 {file_path} 失败，改用格式转换: {str(e)}")
+
         # 如果是word转换为PDF
         if ext in ('.doc', '.docx'):
             file_path = convert_to_pdf(file_path)
             if file_path is None:
-                print("Word 文件转换失败，无法继续解析。")
-                return ""
+                logger.error("Word 文件转换失败，无法继续解析。")
+                return None
             ext = '.pdf'
 
         # 如果是chm或mobi转换为PDF
         if ext in ('.chm', '.mobi'):
             file_path = convert_ebook(file_path)
             if file_path is None:
-                print("文件转换失败，无法继续解析。")
-                return ""
+                logger.error("文件转换失败，无法继续解析。")
+                return None
             ext = '.pdf'
+        return ext, file_path
 
-        total = self._get_total_pages(ext, file_path)
-        end = end_page or total
-        
-        # 页码有效性校验
-        if start_page < 1 or end > total or start_page > end:
-            raise ValueError(f"无效的页码范围 (1-{total})")
-        
-        # 缓存检查
-        cache_key = f"{file_path}-{start_page}-{end}"
-        if cached := self.cache.get(cache_key):
-            return cached
-            
-        # 分页解析
-        content = []
-        for p in range(start_page, end+1):
-            page_content = self._parse_single(ext, file_path, p, use_ocr)
-            content.append(f"=== Page {p}/{total} ===\n{page_content}")
-        
-        result = "\n".join(content)
-        self.cache.set(cache_key, result)
-        return result
+    def _extract_pages(self, ext: str, path: str, pages: List[int], use_ocr: bool,
+                       cancel_event: Optional[threading.Event] = None) -> Dict[int, str]:
+        if self._should_parallelize(ext, len(pages)):
+            return self._parse_pages_parallel(ext, path, pages, use_ocr, cancel_event)
+        return self._parse_pages(ext, path, pages, use_ocr, cancel_event)
+
+    def _should_parallelize(self, ext: str, count: int) -> bool:
+        return ext == '.pdf' and self.workers > 1 and count >= self.parallel_min_pages
+
+    def _parse_pages(self, ext: str, path: str, pages: List[int], use_ocr: bool,
+                     cancel_event: Optional[threading.Event] = None) -> Dict[int, str]:
+        parsed = {}
+        for p in pages:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ParseCancelledError(f"解析已取消，停止于第 {p} 页")
+            parsed[p] = self._parse_single(ext, path, p, use_ocr)
+        return parsed
+
+    def _parse_pages_parallel(self, ext: str, path: str, pages: List[int], use_ocr: bool,
+                              cancel_event: Optional[threading.Event] = None) -> Dict[int, str]:
+        """按连续页段分片到进程池，结果按页码合并"""
+        if self._pool is None:
+            # 服务进程里有事件循环、线程与 SQLite 连接，fork 出的子进程会继承其锁状态
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        # 分片数多于进程数，避免 OCR 页集中在同一分片时负载不均
+        chunk = max(1, -(-len(pages) // (self.workers * 4)))
+        futures = [
+            self._pool.submit(_parse_pages_worker, ext, path, pages[i:i + chunk], use_ocr)
+            for i in range(0, len(pages), chunk)
+        ]
+        parsed = {}
+        try:
+            for future in futures:
+                while True:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise ParseCancelledError("解析已取消")
+                    try:
+                        parsed.update(future.result(timeout=0.5))
+                        break
+                    except FuturesTimeout:
+                        continue
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        return parsed
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        if self._ocr is not None:
+            self._ocr.close()
+        self.docs.close_all()
 
     def _get_total_pages(self, ext: str, path: str) -> int:
         """获取总页数"""
         if ext == '.pdf':
             try:
-                with fitz.open(path) as doc:
+                with self.docs.open(path) as doc:
                     return doc.page_count
             except Exception as e:
-                print(f"打开 PDF 文件 {path} 失败: {str(e)}")
+                logger.error(f"打开 PDF 文件 {path} 失败: {str(e)}")
                 return 0
         elif ext == '.epub':
-            with fitz.open(path) as doc:
-                return doc.page_count
+            return self.epub.page_count(path)
         elif ext == '.txt':
-            with open(path, 'r') as f:
-                return (len(f.readlines()) + 49) // 50
+            return self.txt_index.page_count(path)
+        elif ext in NativeExtractor.EXTENSIONS:
+            return self.native.page_count(path)
         else:
             raise ValueError(f"不支持的格式：{ext}")
 
@@ -79,72 +611,165 @@ class EbookParser:
                      page: int, ocr: bool) -> str:
         """单页解析逻辑"""
         if ext == '.pdf':
-            #print("1.-----------")
-            #print(path)
             return self._parse_pdf_page(path, page, ocr)
         elif ext == '.epub':
-            return self._parse_epub_page(path, page)
+            return self._parse_epub_page(path, page, ocr)
         elif ext == '.txt':
             return self._parse_txt_page(path, page)
+        elif ext in NativeExtractor.EXTENSIONS:
+            with metrics.span('text_extract', format=ext.lstrip('.')):
+                return self.native.read_page(path, page)
         else:
             raise ValueError(f"不支持的格式：{ext}")
     
     def _needs_ocr(self, text: str) -> bool:
         """判断是否需要OCR"""
-        if len(text.strip()) < 50:
+        stripped = text.strip()
+        if len(stripped) < 50:
             return True
         
-        # 检测异常字符
-        abnormal_chars = sum(1 for c in text if ord(c) > 0xff)
-        return abnormal_chars / len(text) > 0.3
+        # 检测异常字符：替换符、私用区、未分配码位与控制字符（字体缺少 ToUnicode 时的典型乱码），
+        # CJK 等正常文字不计入
+        abnormal_chars = sum(
+            1 for c in stripped
+            if c == '\ufffd' or (unicodedata.category(c) in ('Co', 'Cn', 'Cs', 'Cc') and c not in '\n\r\t')
+        )
+        return abnormal_chars / len(stripped) > 0.3
 
     def _parse_pdf_page(self, path: str, page: int, ocr: bool) -> str:
+        import pymupdf as fitz
         try:
-            with fitz.open(path) as doc:
+            with self.docs.open(path) as doc:
                 if doc.page_count == 0:
-                    print(f"PDF 文件 {path} 为空")
+                    logger.warning(f"PDF 文件 {path} 为空")
                     return ""
                 if page > doc.page_count:
-                    print(f"请求的页码 {page} 超出文件总页数 {doc.page_count}")
+                    logger.warning(f"请求的页码 {page} 超出文件总页数 {doc.page_count}")
                     return ""
                 pg = doc[page - 1]
                 if pg is None:
-                    print(f"PDF 文件 {path} 的第 {page} 页获取失败")
+                    logger.warning(f"PDF 文件 {path} 的第 {page} 页获取失败")
                     return ""
-                text = pg.get_text("text", flags=fitz.TEXT_PRESERVE_WHITESPACE)
-                print(pg)
-                print(text)
-                if ocr or self._needs_ocr(text):
-                    try:
-                        blocks = pg.get_text("blocks", flags=fitz.TEXT_PRESERVE_IMAGES)
-                        for b in blocks:
-                            if b[6] == 1:  # 图像块
-                                clip = fitz.Rect(b[:4])
-                                pix = pg.get_pixmap(
-                                    matrix=fitz.Matrix(300/72, 300/72), 
-                                    clip=clip,
-                                    colorspace="rgb",
-                                    alpha=False
-                                )
-                                ocr_text = self.ocr.process(pix)
-                                text += ocr_text
-                    except Exception as e:
-                        print(f"OCR处理失败: {str(e)}")
-                return text
+                with metrics.span('text_extract', format='pdf'):
+                    text = pg.get_text("text", flags=fitz.TEXT_PRESERVE_WHITESPACE)
+                plan = self.ocr_planner.plan(pg, text, not self._needs_ocr(text), ocr)
+                metrics.inc('readbooks_ocr_plans_total', mode=plan.mode)
+                if plan.skipped:
+                    metrics.inc('readbooks_ocr_images_total', plan.skipped, result='too_small')
+                if not plan.targets:
+                    return text
+                try:
+                    lang, keys, results, pixmaps = self._render_ocr_targets(pg, plan.targets, text, path)
+                except Exception as e:
+                    logger.warning(f"OCR处理失败: {str(e)}")
+                    return FailedPage(text)
+            # 像素图已渲染完毕，识别在归还文档句柄后进行，同一文档的其他页不必等待 OCR
+            try:
+                text += ''.join(self._recognize_targets(keys, lang, results, pixmaps, text, path))
+            except Exception as e:
+                logger.warning(f"OCR处理失败: {str(e)}")
+                return FailedPage(text)
+            return text
         except Exception as e:
-            print(f"解析 PDF 文件 {path} 失败: {str(e)}")
-            return ""
+            logger.error(f"解析 PDF 文件 {path} 失败: {str(e)}")
+            return FailedPage("")
+
+    def _render_ocr_targets(self, pg, targets, text_hint: str, doc_key: str):
+        """
+        持有文档句柄时调用：查识别结果缓存并渲染未命中的目标，返回 (语言, 各目标的图像键, 已有结果, 待识别像素图)，
+        后两者以图像键为键；语言尚需脚本检测时渲染全部目标。
+        规划器未给出键的目标（区域内还有文字或图形）先渲染，以像素内容摘要为键
+        """
+        lang = self.ocr.resolve_language(text_hint=text_hint, doc_key=doc_key)
+        keys, results, pixmaps = [], {}, {}
+        with metrics.span('pixmap_render'):
+            for target in targets:
+                key, pixmap = target.key, None
+                if key is None:
+                    pixmap = self._render_target(pg, target)
+                    samples = getattr(pixmap, 'samples_mv', None) or pixmap.samples
+                    key = f"render:{hashlib.sha1(samples).hexdigest()}@{target.dpi}"
+                keys.append(key)
+                if key in results or key in pixmaps:
+                    continue
+                if lang is not None:
+                    cached = self.ocr_results.get(self._ocr_cache_key(key, lang))
+                    if cached is not None:
+                        results[key] = cached
+                        continue
+                pixmaps[key] = pixmap if pixmap is not None else self._render_target(pg, target)
+        return lang, keys, results, pixmaps
+
+    def _recognize_targets(self, keys: List[str], lang: Optional[str], results: dict, pixmaps: dict,
+                           text_hint: str, doc_key: str) -> List[str]:
+        """识别已渲染的目标；同一图像在整本书内按同一语言只识别一次"""
+        if lang is None:
+            # 每本书只发生一次：对第一张图做脚本检测确定语言，再查缓存
+            lang = self.ocr.resolve_language(pixmaps[keys[0]], text_hint, doc_key)
+            for image_key in list(pixmaps):
+                cached = self.ocr_results.get(self._ocr_cache_key(image_key, lang))
+                if cached is not None:
+                    results[image_key] = cached
+                    del pixmaps[image_key]
+        metrics.inc('readbooks_ocr_images_total', len(results), result='cached')
+        if pixmaps:
+            image_keys = list(pixmaps)
+            # 同页待识别图像整批送入 OCR 引擎
+            texts = self.ocr.process_batch([pixmaps[k] for k in image_keys], lang=lang, doc_key=doc_key)
+            metrics.inc('readbooks_ocr_images_total', len(image_keys), result='ocr')
+            for image_key, ocr_text in zip(image_keys, texts):
+                results[image_key] = ocr_text
+                self.ocr_results.set(self._ocr_cache_key(image_key, lang), ocr_text)
+        return [results[key] for key in keys]
+
+    def _render_target(self, pg, target):
+        import pymupdf as fitz
+        zoom = target.dpi / 72
+        return pg.get_pixmap(
+            matrix=fitz.Matrix(zoom, zoom),
+            clip=target.clip,
+            colorspace="rgb" if self.ocr.needs_color else "gray",
+            alpha=False
+        )
+
+    def _ocr_cache_key(self, image_key: str, lang: str) -> str:
+        """同一图像在不同语言或识别模式下结果不同，均计入键"""
+        return f"{self.ocr.preset}:{lang}:psm{self.ocr.backend.psm}:{image_key}"
+
+    def _parse_epub_page(self, path: str, page: int, ocr: bool) -> str:
+        with metrics.span('text_extract', format='epub'):
+            text = self.epub.read_page(path, page)
+            names = [] if text.strip() else self.epub.page_images(path, page)
+        if not names:
+            return text
+        if not ocr:
+            return f"[图像页：共 {len(names)} 张图像，启用 OCR 可识别其中文字]"
+        try:
+            return '\n'.join(self._ocr_images(self.epub.read_images(path, names), path))
+        except Exception as e:
+            logger.warning(f"OCR处理失败: {str(e)}")
+            return FailedPage("")
 
-    def _parse_epub_page(self, path: str, page: int) -> str:
-        with fitz.open(path) as doc:
-            return doc[page-1].get_text("text")
+    def _ocr_images(self, images: List[bytes], doc_key: str) -> List[str]:
+        """识别已编码的图像（EPUB 内嵌图片），结果按内容摘要缓存"""
+        if not images:
+            return []
+        lang = self.ocr.resolve_language(images[0], doc_key=doc_key)
+        keys = [self._ocr_cache_key(hashlib.sha1(data).hexdigest(), lang) for data in images]
+        results = {key: self.ocr_results.get(key) for key in keys}
+        pending = list({key: data for key, data in zip(keys, images) if results[key] is None}.items())
+        metrics.inc('readbooks_ocr_images_total', len(images) - len(pending), result='cached')
+        if pending:
+            texts = self.ocr.process_batch([data for _, data in pending], lang=lang, doc_key=doc_key)
+            metrics.inc('readbooks_ocr_images_total', len(pending), result='ocr')
+            for (key, _), ocr_text in zip(pending, texts):
+                results[key] = ocr_text
+                self.ocr_results.set(key, ocr_text)
+        return [results[key] for key in keys]
 
     def _parse_txt_page(self, path: str, page: int) -> str:
-        with open(path, 'r') as f:
-            lines = f.readlines()
-            start = (page-1)*50
-            end = min(page*50, len(lines))
-            return ''.join(lines[start:end])
+        with metrics.span('text_extract', format='txt'):
+            return self.txt_index.read_page(path, page)
 
 if __name__ == "__main__":
     parser = EbookParser()
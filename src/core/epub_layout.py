@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import posixpath
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from xml.etree import ElementTree
+
+from core.native_extractors import (
+    decode_html, epub_package, html_to_text, page_spans, unquote_href, xml_local_name
+)
+from utils.cache_paths import get_cache_dir, write_atomic
+
+# 分页规则变化时递增，使已持久化的页表失效
+LAYOUT_VERSION = 2
+
+# XHTML 中的 <img src> 与 SVG <image xlink:href>
+_IMAGE_REF = re.compile(r'<(?:\w+:)?(?:img|image)\b[^>]*?\s(?:src|xlink:href|href)\s*=\s*["\']([^"\']+)["\']', re.I)
+
+
+class EpubLayout:
+    """
+    EPUB 直接按 spine 读取 XHTML 分页：每个 spine 文档另起一页，文档内按字符预算换页，
+    与渲染版式无关。页表（页 -> 文档+字符区间）与目录持久化，读页只需解析所在文档
+
+    只含图像的文档（漫画、扫描版 EPUB）各占一页，页表记录其图像，由调用方决定是否 OCR
+    """
+
+    def __init__(self, page_chars: Optional[int] = None, max_docs: int = 8):
+        self.page_chars = page_chars or int(os.getenv('NATIVE_PAGE_CHARS', 3000))
+        self.index_dir = get_cache_dir('epub_layout')
+        self.max_docs = max_docs
+        self._layouts = {}
+        self._docs = OrderedDict()  # (path, stamp, 文档序号) -> 文档纯文本
+        self._lock = threading.Lock()
+        self._build_locks = {}  # path -> Lock，同一本书只由一个线程生成页表
+
+    def page_count(self, path: str) -> int:
+        return len(self._get(path)['pages'])
+
+    def read_page(self, path: str, page: int) -> str:
+        layout = self._get(path)
+        if page < 1 or page > len(layout['pages']):
+            return ""
+        doc, start, end = layout['pages'][page - 1]
+        return self._doc_text(path, layout, doc)[start:end]
+
+    def page_images(self, path: str, page: int) -> List[str]:
+        """图像页内的图像（包内路径）；文字页返回空列表"""
+        layout = self._get(path)
+        if page < 1 or page > len(layout['pages']):
+            return []
+        return layout['images'].get(str(layout['pages'][page - 1][0]), [])
+
+    def image_pages(self, path: str) -> List[int]:
+        layout = self._get(path)
+        return [page for page, (doc, _, _) in enumerate(layout['pages'], 1)
+                if str(doc) in layout['images']]
+
+    @staticmethod
+    def read_images(path: str, names: List[str]) -> List[bytes]:
+        with zipfile.ZipFile(path) as zf:
+            return [zf.read(name) for name in names]
+
+    def toc(self, path: str) -> List[list]:
+        """目录 [[层级, 标题, 起始页], ...]；书内无导航文件时以各文档首行为题"""
+        return self._get(path)['toc']
+
+    def _get(self, path: str) -> dict:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = [st.st_mtime_ns, st.st_size]
+        with self._lock:
+            layout = self._layouts.get(path)
+            if layout and layout['stamp'] == stamp:
+                return layout
+            build_lock = self._build_locks.setdefault(path, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                layout = self._layouts.get(path)
+                if layout and layout['stamp'] == stamp:
+                    return layout
+            index_file = self.index_dir / (hashlib.sha1(path.encode('utf-8')).hexdigest() + '.json')
+            layout = self._load(index_file, stamp)
+            if layout is None:
+                layout = self._build(path, stamp)
+                write_atomic(index_file, json.dumps(layout, ensure_ascii=False))
+            with self._lock:
+                self._layouts[path] = layout
+        return layout
+
+    def _load(self, index_file, stamp) -> Optional[dict]:
+        try:
+            layout = json.loads(index_file.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+        if (layout.get('stamp') != stamp or layout.get('version') != LAYOUT_VERSION
+                or layout.get('page_chars') != self.page_chars):
+            return None
+        return layout
+
+    def _build(self, path: str, stamp) -> dict:
+        with zipfile.ZipFile(path) as zf:
+            package = epub_package(zf)
+            docs, pages, first_pages, titles, images = [], [], {}, [], {}
+            for name in package['spine']:
+                try:
+                    html = decode_html(zf.read(name), 'utf-8')
+                except KeyError:
+                    continue
+                text = html_to_text(html)
+                spans = page_spans(text.split('\n'), self.page_chars) if text else []
+                if not spans:
+                    refs = _image_refs(zf, html, name)
+                    if not refs:
+                        continue
+                    images[str(len(docs))] = refs
+                    spans = [(0, 0)]
+                else:
+                    titles.append([1, text.split('\n', 1)[0][:60], len(pages) + 1])
+                first_pages[name] = len(pages) + 1
+                pages.extend([len(docs), start, end] for start, end in spans)
+                docs.append(name)
+            toc = _read_toc(zf, package, first_pages) or titles
+        return {
+            'version': LAYOUT_VERSION,
+            'stamp': stamp,
+            'page_chars': self.page_chars,
+            'docs': docs,
+            'pages': pages,
+            'images': images,
+            'toc': toc,
+        }
+
+    @staticmethod
+    def _extract(zf: zipfile.ZipFile, name: str) -> str:
+        return html_to_text(decode_html(zf.read(name), 'utf-8'))
+
+    def _doc_text(self, path: str, layout: dict, doc: int) -> str:
+        key = (os.path.abspath(path), tuple(layout['stamp']), doc)
+        with self._lock:
+            text = self._docs.get(key)
+            if text is not None:
+                self._docs.move_to_end(key)
+                return text
+        with zipfile.ZipFile(path) as zf:
+            text = self._extract(zf, layout['docs'][doc])
+        with self._lock:
+            self._docs[key] = text
+            while len(self._docs) > self.max_docs:
+                self._docs.popitem(last=False)
+        return text
+
+
+def _image_refs(zf: zipfile.ZipFile, html: str, doc_name: str) -> List[str]:
+    """文档引用的、包内确实存在的图像路径（去重、保持顺序）"""
+    base = posixpath.dirname(doc_name)
+    names = set(zf.namelist())
+    refs = []
+    for href in _IMAGE_REF.findall(html):
+        name = posixpath.normpath(posixpath.join(base, unquote_href(href)))
+        if name in names and name not in refs:
+            refs.append(name)
+    return refs
+
+
+def _read_toc(zf: zipfile.ZipFile, package: dict, first_pages: dict) -> List[list]:
+    """优先 EPUB3 导航文档，其次 NCX；条目指向的文档映射为该文档的起始页"""
+    entries = []
+    try:
+        if package['nav']:
+            entries = _nav_entries(zf, package['nav'])
+        if not entries and package['ncx']:
+            entries = _ncx_entries(zf, package['ncx'])
+    except (KeyError, ElementTree.ParseError):
+        entries = []
+    toc = []
+    for level, title, target in entries:
+        page = first_pages.get(target)
+        if page is not None and title:
+            toc.append([level, title[:60], page])
+    return toc
+
+
+def _nav_entries(zf: zipfile.ZipFile, nav_path: str) -> List[Tuple[int, str, str]]:
+    root = ElementTree.fromstring(zf.read(nav_path))
+    base = posixpath.dirname(nav_path)
+    navs = [el for el in root.iter() if xml_local_name(el.tag) == 'nav']
+    toc_nav = next((el for el in navs if any(v == 'toc' for k, v in el.attrib.items()
+                                             if xml_local_name(k) == 'type')), navs[0] if navs else None)
+    entries = []
+
+    def walk(ol, level):
+        for li in ol:
+            if xml_local_name(li.tag) != 'li':
+                continue
+            for child in li:
+                tag = xml_local_name(child.tag)
+                if tag == 'a' and child.get('href'):
+                    title = ' '.join(''.join(child.itertext()).split())
+                    target = posixpath.normpath(posixpath.join(base, unquote_href(child.get('href'))))
+                    entries.append((level, title, target))
+                elif tag == 'ol':
+                    walk(child, level + 1)
+
+    if toc_nav is not None:
+        for child in toc_nav:
+            if xml_local_name(child.tag) == 'ol':
+                walk(child, 1)
+    return entries
+
+
+def _ncx_entries(zf: zipfile.ZipFile, ncx_path: str) -> List[Tuple[int, str, str]]:
+    root = ElementTree.fromstring(zf.read(ncx_path))
+    base = posixpath.dirname(ncx_path)
+    entries = []
+
+    def walk(parent, level):
+        for point in parent:
+            if xml_local_name(point.tag) != 'navPoint':
+                continue
+            title, target = '', None
+            for child in point:
+                tag = xml_local_name(child.tag)
+                if tag == 'navLabel':
+                    title = ' '.join(''.join(child.itertext()).split())
+                elif tag == 'content' and child.get('src'):
+                    target = posixpath.normpath(posixpath.join(base, unquote_href(child.get('src'))))
+            if target:
+                entries.append((level, title, target))
+            walk(point, level + 1)
+
+    nav_map = next((el for el in root.iter() if xml_local_name(el.tag) == 'navMap'), None)
+    if nav_map is not None:
+        walk(nav_map, 1)
+    return entries
@@ -0,0 +1,76 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from utils.cache_paths import get_cache_dir
+from utils.fingerprint import file_fingerprint
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    info TEXT,
+    updated REAL NOT NULL
+);
+"""
+
+
+class MetadataStore:
+    """按路径持久化的书籍元数据（指纹、页数、目录、页面类型），mtime/size 变化即失效"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or str(get_cache_dir('metadata') / 'metadata.db')
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _row(self, path: str):
+        st = os.stat(path)
+        row = self._connect().execute(
+            'SELECT mtime_ns, size, fingerprint, info FROM books WHERE path = ?', (path,)
+        ).fetchone()
+        if row and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+            return st, row
+        return st, None
+
+    def fingerprint(self, path: str) -> str:
+        """文件内容指纹；文件未变化时直接取已记录的值，重启后无需重新哈希"""
+        path = os.path.abspath(path)
+        st, row = self._row(path)
+        if row:
+            return row[2]
+        fingerprint = file_fingerprint(path)
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, NULL, ?)',
+                (path, st.st_mtime_ns, st.st_size, fingerprint, time.time())
+            )
+        return fingerprint
+
+    def get_info(self, path: str) -> Optional[dict]:
+        _, row = self._row(os.path.abspath(path))
+        if row and row[3]:
+            return json.loads(row[3])
+        return None
+
+    def put_info(self, path: str, info: dict):
+        path = os.path.abspath(path)
+        fingerprint = self.fingerprint(path)
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE books SET info = ?, updated = ? WHERE path = ? AND fingerprint = ?',
+                (json.dumps(info, ensure_ascii=False), time.time(), path, fingerprint)
+            )
@@ -0,0 +1,289 @@
+import os
+import posixpath
+import re
+import shutil
+import threading
+import zipfile
+from collections import OrderedDict
+from html import unescape
+from html.parser import HTMLParser
+from typing import Iterable, List, Optional, Tuple
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+_BLOCK_TAGS = {
+    'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'section', 'article', 'blockquote', 'pre', 'table', 'dt', 'dd',
+}
+_SKIP_TAGS = {'script', 'style', 'head', 'title'}
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    """HTML/XHTML 转纯文本：按块级元素分段，去除脚本样式"""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    text = ''.join(parser.parts)
+    lines = (re.sub(r'[ \t\r\f\v　]+', ' ', line).strip() for line in text.split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def paginate(chapters: Iterable[List[str]], page_chars: int) -> List[str]:
+    """
+    稳定的虚拟分页：每章另起一页，章内按段落累积到 page_chars 字符换页，
+    超长段落按字符预算切开。相同内容与预算总得到相同页码。
+    """
+    pages = []
+    for paragraphs in chapters:
+        paragraphs = [para for para in paragraphs if para]
+        text = '\n'.join(paragraphs)
+        pages.extend(text[start:end] for start, end in page_spans(paragraphs, page_chars))
+    return pages
+
+
+def page_spans(paragraphs: List[str], page_chars: int) -> List[Tuple[int, int]]:
+    """paginate 的区间形式：返回一章内各页在 '\n'.join(paragraphs) 中的 [起, 止) 字符区间"""
+    spans = []
+    pos = 0
+    start = end = None
+    size = 0
+    for para in paragraphs:
+        offset = pos
+        pos += len(para) + 1
+        while len(para) > page_chars:
+            if start is not None:
+                spans.append((start, end))
+                start, size = None, 0
+            spans.append((offset, offset + page_chars))
+            offset += page_chars
+            para = para[page_chars:]
+        if start is not None and size + len(para) > page_chars:
+            spans.append((start, end))
+            start, size = None, 0
+        if para:
+            if start is None:
+                start = offset
+            end = offset + len(para)
+            size += len(para) + 1
+    if start is not None:
+        spans.append((start, end))
+    return spans
+
+
+def xml_local_name(tag: str) -> str:
+    """去掉 XML 命名空间前缀"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def epub_package(zf: zipfile.ZipFile) -> dict:
+    """解析 OPF：按 spine 顺序的文档路径，以及 EPUB3 导航文档与 NCX 的路径（可能为 None）"""
+    container = ElementTree.fromstring(zf.read('META-INF/container.xml'))
+    rootfile = next(el for el in container.iter() if xml_local_name(el.tag) == 'rootfile')
+    opf_path = rootfile.get('full-path')
+    opf = ElementTree.fromstring(zf.read(opf_path))
+    base = posixpath.dirname(opf_path)
+
+    def resolve(href):
+        return posixpath.normpath(posixpath.join(base, unquote_href(href)))
+
+    manifest, spine, nav, ncx = {}, [], None, None
+    for el in opf.iter():
+        tag = xml_local_name(el.tag)
+        if tag == 'item':
+            manifest[el.get('id')] = resolve(el.get('href', ''))
+            if 'nav' in (el.get('properties') or '').split():
+                nav = manifest[el.get('id')]
+            elif el.get('media-type') == 'application/x-dtbncx+xml':
+                ncx = ncx or manifest[el.get('id')]
+        elif tag == 'spine' and el.get('toc'):
+            ncx = manifest.get(el.get('toc'), ncx)
+    for el in opf.iter():
+        if xml_local_name(el.tag) == 'itemref' and el.get('idref') in manifest:
+            spine.append(manifest[el.get('idref')])
+    return {'spine': spine, 'nav': nav, 'ncx': ncx}
+
+
+def epub_spine_documents(zf: zipfile.ZipFile) -> List[str]:
+    """按 OPF spine 顺序返回 EPUB 内的 XHTML 文档路径"""
+    return epub_package(zf)['spine']
+
+
+def unquote_href(href: str) -> str:
+    return unquote(href.split('#', 1)[0])
+
+
+def decode_html(data: bytes, fallback: str = 'gb18030') -> str:
+    """优先按声明的 charset 解码，其次 UTF-8，最后回退到 fallback"""
+    match = re.search(rb'charset=["\']?([\w-]+)', data[:2048], re.I)
+    encodings = [match.group(1).decode('ascii')] if match else []
+    for encoding in encodings + ['utf-8']:
+        try:
+            return data.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return data.decode(fallback, errors='replace')
+
+
+class NativeExtractor:
+    """DOCX/MOBI/CHM 直接读取文本并虚拟分页，无需先转换为 PDF"""
+    EXTENSIONS = ('.docx', '.mobi', '.chm')
+
+    def __init__(self, page_chars: Optional[int] = None, max_books: int = 4):
+        self.page_chars = page_chars or int(os.getenv('NATIVE_PAGE_CHARS', 3000))
+        self.max_books = max_books
+        self._books = OrderedDict()  # (path, mtime, size) -> (pages, toc)
+        self._lock = threading.Lock()
+
+    def supports(self, ext: str) -> bool:
+        if ext not in self.EXTENSIONS:
+            return False
+        module = {'.docx': 'docx', '.mobi': 'mobi', '.chm': 'chm'}[ext]
+        try:
+            __import__(module)
+        except ImportError:
+            return False
+        return True
+
+    def page_count(self, path: str) -> int:
+        return len(self._load(path)[0])
+
+    def read_page(self, path: str, page: int) -> str:
+        pages = self._load(path)[0]
+        if page < 1 or page > len(pages):
+            return ""
+        return pages[page - 1]
+
+    def toc(self, path: str) -> List[list]:
+        """章节目录 [[层级, 标题(章首段), 起始页], ...]"""
+        return self._load(path)[1]
+
+    def _load(self, path: str) -> Tuple[List[str], List[list]]:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            book = self._books.get(key)
+            if book is not None:
+                self._books.move_to_end(key)
+                return book
+        ext = os.path.splitext(path)[1].lower()
+        loader = {'.docx': self._load_docx, '.mobi': self._load_mobi, '.chm': self._load_chm}[ext]
+        pages, toc = [], []
+        for chapter in loader(path):
+            chapter_pages = paginate([chapter], self.page_chars)
+            if chapter_pages:
+                toc.append([1, chapter[0][:60], len(pages) + 1])
+                pages.extend(chapter_pages)
+        book = (pages, toc)
+        with self._lock:
+            self._books[key] = book
+            while len(self._books) > self.max_books:
+                self._books.popitem(last=False)
+        return book
+
+    @staticmethod
+    def _load_docx(path: str) -> List[List[str]]:
+        """按一级标题分章，段落与表格单元格按文档顺序读取"""
+        import docx
+        from docx.table import Table
+        from docx.text.paragraph import Paragraph
+
+        document = docx.Document(path)
+        chapters, current = [], []
+        for child in document.element.body.iterchildren():
+            tag = child.tag.rsplit('}', 1)[-1]
+            if tag == 'p':
+                para = Paragraph(child, document)
+                text = para.text.strip()
+                style = para.style.name if para.style is not None else ''
+                if style in ('Heading 1', 'Title', '标题 1', '标题') and current:
+                    chapters.append(current)
+                    current = []
+                if text:
+                    current.append(text)
+            elif tag == 'tbl':
+                for row in Table(child, document).rows:
+                    cells = [cell.text.strip() for cell in row.cells]
+                    line = '\t'.join(cell for cell in cells if cell)
+                    if line:
+                        current.append(line)
+        if current:
+            chapters.append(current)
+        return chapters
+
+    @staticmethod
+    def _load_mobi(path: str) -> List[List[str]]:
+        """解包 MOBI：KF8 得到 EPUB 按 spine 分章，旧格式 HTML 按分页标记分章"""
+        import mobi
+
+        tempdir, extracted = mobi.extract(path)
+        try:
+            if extracted.endswith('.epub'):
+                chapters = []
+                with zipfile.ZipFile(extracted) as zf:
+                    for name in epub_spine_documents(zf):
+                        text = html_to_text(decode_html(zf.read(name), 'utf-8'))
+                        if text:
+                            chapters.append(text.split('\n'))
+                return chapters
+            if extracted.endswith('.html'):
+                with open(extracted, 'rb') as f:
+                    html = decode_html(f.read(), 'utf-8')
+                parts = re.split(r'<mbp:pagebreak\s*/?>', html, flags=re.I)
+                return [text.split('\n') for text in map(html_to_text, parts) if text]
+            raise ValueError(f"MOBI 解包结果无法直接读取: {extracted}")
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+    @staticmethod
+    def _load_chm(path: str) -> List[List[str]]:
+        """按目录（.hhc）顺序读取 CHM 内的 HTML 页面，每个主题为一章"""
+        from chm.chm import CHMFile
+
+        chm_file = CHMFile()
+        if not chm_file.LoadCHM(path):
+            raise ValueError(f"无法打开 CHM 文件: {path}")
+        try:
+            topics = chm_file.GetTopicsTree() or b''
+            locals_ = re.findall(rb'<param\s+name="Local"\s+value="([^"]+)"', topics, re.I)
+            chapters, seen = [], set()
+            for local in locals_:
+                name = '/' + unescape(local.decode('utf-8', 'ignore')).split('#', 1)[0].lstrip('/')
+                if name in seen:
+                    continue
+                seen.add(name)
+                result, ui = chm_file.ResolveObject(name.encode('utf-8'))
+                if result != 0:
+                    continue
+                _, content = chm_file.RetrieveObject(ui)
+                text = html_to_text(decode_html(content))
+                if text:
+                    chapters.append(text.split('\n'))
+            if not chapters:
+                raise ValueError(f"CHM 文件没有可读取的目录主题: {path}")
+            return chapters
+        finally:
+            chm_file.CloseCHM()
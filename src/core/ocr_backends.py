@@ -0,0 +1,164 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+# 与原 pytesseract 调用保持一致的识别参数
+PSM_SINGLE_BLOCK = 6
+OEM_LSTM_ONLY = 1
+TESS_VARIABLES = {
+    'preserve_interword_spaces': '1',
+    'tessedit_char_blacklist': '|\\`~',
+}
+CJK_SCRIPTS = ('Han', 'HanS', 'HanT', 'Hiragana', 'Katakana')
+
+
+class OCRBackend:
+    """OCR 引擎接口"""
+    name = 'base'
+    psm = PSM_SINGLE_BLOCK
+
+    def recognize(self, image: np.ndarray, lang: str) -> str:
+        raise NotImplementedError
+
+    def recognize_batch(self, images: Sequence[np.ndarray], lang: str) -> List[str]:
+        return [self.recognize(image, lang) for image in images]
+
+    def detect_script(self, image: np.ndarray) -> Optional[str]:
+        """返回脚本名（如 Han/Latin），无法判定时返回 None"""
+        return None
+
+    def close(self):
+        """释放引擎持有的资源"""
+
+
+class PytesseractBackend(OCRBackend):
+    """每次调用启动一个 tesseract 子进程，作为兜底实现"""
+    name = 'pytesseract'
+
+    def __init__(self):
+        import pytesseract
+        self._pytesseract = pytesseract
+        self._setup_tesseract()
+        self.config = (
+            f'--psm {PSM_SINGLE_BLOCK} --oem {OEM_LSTM_ONLY} '
+            + ' '.join(f'-c {k}={v}' for k, v in TESS_VARIABLES.items())
+        )
+
+    def _setup_tesseract(self):
+        """自动配置Tesseract路径"""
+        default_paths = [
+            r'C:\Program Files\Tesseract-OCR\tesseract.exe',
+            r'C:\Program Files (x86)\Tesseract-OCR\tesseract.exe',
+            '/usr/bin/tesseract'
+        ]
+
+        for path in default_paths:
+            if os.path.exists(path):
+                self._pytesseract.pytesseract.tesseract_cmd = path
+                break
+        else:
+            self._pytesseract.pytesseract.tesseract_cmd = 'tesseract'
+
+    def recognize(self, image: np.ndarray, lang: str) -> str:
+        return self._pytesseract.image_to_string(
+            image,
+            lang=lang,
+            config=self.config,
+            timeout=30
+        )
+
+    def detect_script(self, image: np.ndarray) -> Optional[str]:
+        try:
+            osd = self._pytesseract.image_to_osd(image, config='--psm 0', output_type='dict', timeout=10)
+        except Exception:
+            return None
+        return osd.get('script')
+
+
+class TesserocrBackend(OCRBackend):
+    """
+    进程内调用 libtesseract：模型按线程、按语言加载一次后复用
+
+    每个线程最多保留 OCR_MAX_ENGINES 个引擎实例（每个占用数十 MB），
+    超出时按最近最少使用释放
+    """
+    name = 'tesserocr'
+
+    def __init__(self, max_engines: Optional[int] = None):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self.max_engines = max(1, max_engines or int(os.getenv('OCR_MAX_ENGINES', 4)))
+        self._local = threading.local()
+        # 各线程的引擎表，close() 时统一释放
+        self._tables = []
+        self._lock = threading.Lock()
+
+    def _api(self, lang: str, psm: int = PSM_SINGLE_BLOCK):
+        apis = getattr(self._local, 'apis', None)
+        if apis is None:
+            apis = self._local.apis = OrderedDict()
+            with self._lock:
+                self._tables.append(apis)
+        key = (lang, psm)
+        api = apis.get(key)
+        if api is not None:
+            apis.move_to_end(key)
+            return api
+        api = self._tesserocr.PyTessBaseAPI(lang=lang, psm=psm, oem=OEM_LSTM_ONLY)
+        for name, value in TESS_VARIABLES.items():
+            api.SetVariable(name, value)
+        with self._lock:
+            apis[key] = api
+            while len(apis) > self.max_engines:
+                _, evicted = apis.popitem(last=False)
+                evicted.End()
+        return api
+
+    def close(self):
+        with self._lock:
+            for apis in self._tables:
+                for api in apis.values():
+                    api.End()
+                apis.clear()
+            self._tables.clear()
+
+    def recognize(self, image: np.ndarray, lang: str) -> str:
+        api = self._api(lang)
+        api.SetImage(Image.fromarray(image))
+        return api.GetUTF8Text()
+
+    def recognize_batch(self, images: Sequence[np.ndarray], lang: str) -> List[str]:
+        api = self._api(lang)
+        texts = []
+        for image in images:
+            api.SetImage(Image.fromarray(image))
+            texts.append(api.GetUTF8Text())
+        return texts
+
+    def detect_script(self, image: np.ndarray) -> Optional[str]:
+        try:
+            api = self._api('osd', psm=self._tesserocr.PSM.OSD_ONLY)
+            api.SetImage(Image.fromarray(image))
+            result = api.DetectOrientationScript()
+        except Exception:
+            return None
+        return result.get('script_name') if result else None
+
+
+def create_backend(name: Optional[str] = None) -> OCRBackend:
+    """按 OCR_BACKEND（auto/tesserocr/pytesseract）创建引擎；auto 优先进程内引擎"""
+    name = (name or os.getenv('OCR_BACKEND', 'auto')).lower()
+    if name == 'pytesseract':
+        return PytesseractBackend()
+    if name == 'tesserocr':
+        return TesserocrBackend()
+    if name != 'auto':
+        raise ValueError(f"未知的OCR引擎：{name}")
+    try:
+        return TesserocrBackend()
+    except ImportError:
+        return PytesseractBackend()
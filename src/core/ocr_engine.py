@@ -1,117 +1,228 @@
-import pytesseract
-from PIL import Image, ImageEnhance
+from PIL import Image
 import io
 import numpy as np
 import os
 import cv2
 import re
-from typing import Union
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, List, Optional, Sequence, Union
+from core.ocr_backends import CJK_SCRIPTS, OCRBackend, create_backend
+from utils.metrics import metrics
+
+if TYPE_CHECKING:
+    import pymupdf as fitz
+
+# 预处理预设：只保留最终送入 OCR 的阶段；不以 gray 开头的预设在彩色图上处理
+PRESETS = {
+    'fast': ('gray',),
+    'accurate': ('gray', 'clahe'),
+}
 
 class OCRProcessor:
-    def __init__(self):
-        self._setup_tesseract()
+    def __init__(self, preset: Optional[str] = None, backend: Optional[OCRBackend] = None):
+        self.backend = backend or create_backend()
+        self.preset = preset or os.getenv('OCR_PRESET', 'accurate')
+        if self.preset not in PRESETS:
+            raise ValueError(f"未知的OCR预处理预设：{self.preset}")
+        self._clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        # 各阶段耗时统计：stage -> [次数, 累计秒数]
+        self.stage_stats = {}
+        self._stats_lock = threading.Lock()
         self.correction_rules = {
             r'ﬁ': 'fi', r'ﬂ': 'fl', r'\$分刀': '分析', 
             r'′`': "'", r'WS MEN': 'Wittgenstein'
         }
+        self.default_lang = os.getenv('OCR_DEFAULT_LANG', 'chi_sim+eng')
+        # 按文档缓存的语言判定，同一本书只检测一次
+        self._doc_langs = OrderedDict()
 
-    def _setup_tesseract(self):
-        """自动配置Tesseract路径"""
-        default_paths = [
-            r'C:\Program Files\Tesseract-OCR\tesseract.exe',
-            r'C:\Program Files (x86)\Tesseract-OCR\tesseract.exe',
-            '/usr/bin/tesseract'
-        ]
-        
-        for path in default_paths:
-            if os.path.exists(path):
-                pytesseract.pytesseract.tesseract_cmd = path
-                break
-        else:
-            pytesseract.pytesseract.tesseract_cmd = 'tesseract'
+    def process(self, image_input: Union[bytes, 'fitz.Pixmap', Image.Image],
+                lang: Optional[str] = None, text_hint: str = "",
+                doc_key: Optional[str] = None) -> str:
+        """
+        主处理流程
 
-    def process(self, image_input: Union[bytes, 'fitz.Pixmap', Image.Image]) -> str:
-        """主处理流程"""
+        lang 为空时依次按 文档缓存 → 文本层提示 text_hint → OSD 脚本检测 选择语言，
+        每张图只执行一次完整识别
+        """
         try:
             # 输入标准化
-            image = self._normalize_input(image_input)
+            with self._timed('normalize'):
+                image = self._normalize_input(image_input)
             
             # 图像增强
             enhanced = self._enhance_image(image)
             
             # 动态语言选择
-            lang = self._detect_language(enhanced)
+            with self._timed('detect_language'):
+                lang = lang or self._detect_language(enhanced, text_hint, doc_key)
             
             # OCR执行
-            text = self._run_ocr(enhanced, lang)
+            with self._timed('ocr'):
+                text = self._run_ocr(enhanced, lang)
             
             # 后处理
-            return self._postprocess(text)
+            with self._timed('postprocess'):
+                return self._postprocess(text)
             
         except Exception as e:
             raise RuntimeError(f"OCR处理失败: {str(e)}")
 
-    def _normalize_input(self, input_data):
-        """输入标准化"""
+    def process_batch(self, image_inputs: Sequence[Union[bytes, 'fitz.Pixmap', Image.Image]],
+                      lang: Optional[str] = None, text_hint: str = "",
+                      doc_key: Optional[str] = None) -> List[str]:
+        """批量识别同一文档的多张图：语言只判定一次，引擎一次调用处理整批"""
+        if not image_inputs:
+            return []
+        try:
+            enhanced = []
+            for image_input in image_inputs:
+                with self._timed('normalize'):
+                    image = self._normalize_input(image_input)
+                enhanced.append(self._enhance_image(image))
+
+            with self._timed('detect_language'):
+                lang = lang or self._detect_language(enhanced[0], text_hint, doc_key)
+
+            with self._timed('ocr'):
+                texts = self.backend.recognize_batch(enhanced, lang)
+
+            with self._timed('postprocess'):
+                return [self._postprocess(text) for text in texts]
+
+        except Exception as e:
+            raise RuntimeError(f"OCR处理失败: {str(e)}")
+
+    def resolve_language(self, image_input: Union[bytes, 'fitz.Pixmap', Image.Image, None] = None,
+                         text_hint: str = "", doc_key: Optional[str] = None) -> Optional[str]:
+        """
+        在识别前确定语言（识别结果按语言缓存）：依次按 文档缓存 → 文本层提示 → image_input 的 OSD 检测；
+        前两者不可用且未提供图像时返回 None
+        """
+        lang = self._detect_language(None, text_hint, doc_key)
+        if lang is None and image_input is not None:
+            with self._timed('normalize'):
+                image = self._normalize_input(image_input)
+            enhanced = self._enhance_image(image)
+            with self._timed('detect_language'):
+                lang = self._detect_language(enhanced, text_hint, doc_key)
+        return lang
+
+    def close(self):
+        """释放 OCR 引擎（进程内引擎持有已加载的语言模型）"""
+        self.backend.close()
+
+    @property
+    def needs_color(self) -> bool:
+        """当前预设是否需要彩色输入；否则调用方可直接渲染灰度像素图"""
+        stages = PRESETS[self.preset]
+        return not stages or stages[0] != 'gray'
+
+    def _normalize_input(self, input_data) -> np.ndarray:
+        """
+        输入标准化为 NumPy 数组；fitz.Pixmap 直接映射其像素缓冲区，不做拷贝。
+        编码图像与 PIL 图像统一转为灰度（预设需要彩色时为 RGB），
+        1 位、调色板、LA、CMYK 等模式不能直接送入预处理阶段
+        """
         if isinstance(input_data, bytes):
-            return Image.open(io.BytesIO(input_data))
+            input_data = Image.open(io.BytesIO(input_data))
+        if isinstance(input_data, Image.Image):
+            if input_data.mode in ('RGBA', 'LA', 'PA') or 'transparency' in input_data.info:
+                # 透明背景铺白，否则转换后成为黑底
+                rgba = input_data.convert('RGBA')
+                input_data = Image.alpha_composite(Image.new('RGBA', rgba.size, 'white'), rgba)
+            return np.asarray(input_data.convert('RGB' if self.needs_color else 'L'))
         elif hasattr(input_data, 'samples'):  # fitz.Pixmap
-            return Image.frombytes('RGB', 
-                                 (input_data.width, input_data.height),
-                                 input_data.samples)
-        elif isinstance(input_data, Image.Image):
-            return input_data
+            buf = getattr(input_data, 'samples_mv', None) or input_data.samples
+            arr = np.frombuffer(buf, dtype=np.uint8)
+            arr = arr.reshape(input_data.height, input_data.stride)
+            arr = arr[:, :input_data.width * input_data.n]
+            if input_data.n == 1:
+                return arr
+            return arr.reshape(input_data.height, input_data.width, input_data.n)
         else:
             raise ValueError("不支持的输入类型")
 
-    def _enhance_image(self, image: Image.Image) -> Image.Image:
-        """六步图像增强"""
-        # 转换为OpenCV格式
-        img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        
-        # 1. 自适应阈值
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        thresh = cv2.adaptiveThreshold(
-            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY_INV, 31, 10
-        )
-        
-        # 2. 噪声去除
-        kernel = np.ones((2, 2), np.uint8)
-        cleaned = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
-        
-        # 3. 锐化
-        sharpen = cv2.filter2D(cleaned, -1, np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]]))
-        
-        # 4. 对比度增强
-        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-        limg = cv2.merge([clahe.apply(l), a, b])
-        
-        # 转换回PIL
-        final = cv2.cvtColor(limg, cv2.COLOR_LAB2RGB)
-        return Image.fromarray(final)
-
-    # 在_detect_language方法中增加
-    def _detect_language(self, image: Image.Image) -> str:
-        sample = pytesseract.image_to_string(image, lang='chi_sim+eng')[:100]
-        chinese_ratio = len(re.findall(r'[\u4e00-\u9fff]', sample)) / len(sample) if sample else 0
+    def _enhance_image(self, image: np.ndarray) -> np.ndarray:
+        """按预设依次执行预处理阶段"""
+        for stage in PRESETS[self.preset]:
+            with self._timed(stage):
+                image = getattr(self, f'_stage_{stage}')(image)
+        return image
+
+    @staticmethod
+    def _stage_gray(image: np.ndarray) -> np.ndarray:
+        if image.ndim == 2:
+            return image
+        code = cv2.COLOR_RGBA2GRAY if image.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+        return cv2.cvtColor(image, code)
+
+    def _stage_clahe(self, image: np.ndarray) -> np.ndarray:
+        """对比度增强（灰度图上的 CLAHE，等价于原先在 LAB 亮度通道上处理）"""
+        return self._clahe.apply(image)
+
+    @contextmanager
+    def _timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            with metrics.span(f"ocr_{'tesseract' if stage == 'ocr' else stage}"):
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                entry = self.stage_stats.setdefault(stage, [0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def stage_timings(self) -> dict:
+        """各阶段调用次数、累计与平均耗时（秒）"""
+        with self._stats_lock:
+            return {
+                stage: {'count': count, 'total': total, 'avg': total / count}
+                for stage, (count, total) in self.stage_stats.items()
+            }
+
+    def _detect_language(self, image: Optional[np.ndarray], text_hint: str = "",
+                         doc_key: Optional[str] = None) -> Optional[str]:
+        """低成本语言判定：不再为取样额外跑一遍完整 OCR；需要 OSD 而未给出图像时返回 None"""
+        if doc_key and doc_key in self._doc_langs:
+            return self._doc_langs[doc_key]
+        hint = re.sub(r'\s+', '', text_hint)
+        if len(hint) >= 20:
+            lang = self._lang_for_text(hint)
+        elif image is None:
+            return None
+        else:
+            lang = self._lang_from_osd(image)
+        # OSD 失败同样按文档记住默认值，避免每张图重复尝试
+        lang = lang or self.default_lang
+        if doc_key:
+            self._doc_langs[doc_key] = lang
+            if len(self._doc_langs) > 256:
+                self._doc_langs.popitem(last=False)
+        return lang
+
+    @staticmethod
+    def _lang_for_text(text: str) -> str:
+        chinese_ratio = len(re.findall(r'[\u4e00-\u9fff]', text)) / len(text)
         return 'chi_sim+eng' if chinese_ratio > 0.3 else 'eng+chi_sim'
 
-    def _run_ocr(self, image: Image.Image, lang: str) -> str:
+    def _lang_from_osd(self, image: np.ndarray) -> Optional[str]:
+        """在缩小的图像上做 OSD 脚本检测，失败（缺少 osd 模型或文字过少）时返回 None"""
+        scale = 1000 / max(image.shape[:2])
+        small = cv2.resize(image, None, fx=scale, fy=scale,
+                           interpolation=cv2.INTER_AREA) if scale < 1 else image
+        script = self.backend.detect_script(small)
+        if not script:
+            return None
+        return 'chi_sim+eng' if script in CJK_SCRIPTS else 'eng+chi_sim'
+
+    def _run_ocr(self, image: np.ndarray, lang: str) -> str:
         """执行OCR核心"""
-        config = (
-            '--psm 6 --oem 1 '
-            '-c preserve_interword_spaces=1 '
-            '-c tessedit_char_blacklist=|\\`~'
-        )
-        return pytesseract.image_to_string(
-            image, 
-            lang=lang,
-            config=config,
-            timeout=30
-        )
+        return self.backend.recognize(image, lang)
 
     def _postprocess(self, text: str) -> str:
         """五步文本净化"""
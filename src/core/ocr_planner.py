@@ -0,0 +1,109 @@
+import os
+import statistics
+from typing import List, NamedTuple, Optional
+
+import pymupdf as fitz
+
+
+class OCRTarget(NamedTuple):
+    key: Optional[str]          # 图像内容摘要 + DPI，跨页复用识别结果；区域内另有文字或图形时为 None
+    clip: Optional[fitz.Rect]   # None 表示整页渲染
+    dpi: int
+
+
+class OCRPlan(NamedTuple):
+    mode: str                   # skip / page / blocks
+    targets: List[OCRTarget]
+    skipped: int                # 因尺寸过小而跳过的图像数
+
+
+class OCRPlanner:
+    """按页面构成决定 OCR 方式：跳过、整页一次识别或逐图像块识别，并按图像分辨率与字号选择 DPI"""
+
+    def __init__(self):
+        self.min_image_pt = float(os.getenv('OCR_MIN_IMAGE_PT', 48))
+        self.min_dpi = int(os.getenv('OCR_MIN_DPI', 150))
+        self.max_dpi = int(os.getenv('OCR_MAX_DPI', 300))
+        self.page_coverage = float(os.getenv('OCR_PAGE_COVERAGE', 0.6))
+
+    def plan(self, pg, text: str, text_ok: bool, force: bool) -> OCRPlan:
+        """text_ok 表示文本层可用；force 为调用方显式要求 OCR"""
+        if text_ok and not force:
+            return OCRPlan('skip', [], 0)
+
+        page_rect = pg.rect
+        images, skipped = [], 0
+        placed = []  # 页面上的全部图像（含过小跳过的），用于判断渲染区域是否只有目标图像
+        seen = set()
+        for info in pg.get_image_info(hashes=True, xrefs=True):
+            bbox = fitz.Rect(info['bbox']) & page_rect
+            if bbox.is_empty:
+                continue
+            digest = info.get('digest')
+            key = digest.hex() if digest else f"xref{info.get('xref', 0)}"
+            placed.append((key, bbox))
+            if bbox.width < self.min_image_pt or bbox.height < self.min_image_pt:
+                # 图标、项目符号、装饰线等
+                skipped += 1
+                continue
+            if (key, tuple(bbox)) in seen:
+                continue
+            seen.add((key, tuple(bbox)))
+            images.append((key, bbox, info))
+        if not images:
+            return OCRPlan('skip', [], skipped)
+
+        overlays = self._overlays(pg)
+        area = abs(page_rect) or 1
+        coverage = min(1.0, sum(abs(bbox) for _, bbox, _ in images) / area)
+        glyph_dpi = self._glyph_dpi(pg) if text.strip() else None
+        if coverage >= self.page_coverage:
+            # 扫描页：整页渲染一次，避免逐块裁剪
+            native = max(self._native_dpi(info, bbox) for _, bbox, info in images)
+            dpi = self._choose_dpi(native, glyph_dpi)
+            key = None
+            if not any(rect.intersects(page_rect) for rect in overlays):
+                # 整页渲染结果只取决于页上的图像
+                key = f"page:{'+'.join(sorted(k for k, _ in placed))}@{dpi}"
+            return OCRPlan('page', [OCRTarget(key, None, dpi)], skipped)
+
+        targets = []
+        for key, bbox, info in images:
+            dpi = self._choose_dpi(self._native_dpi(info, bbox), glyph_dpi)
+            covered = (any(rect.intersects(bbox) for rect in overlays)
+                       or any(other.intersects(bbox) for k, other in placed
+                              if (k, tuple(other)) != (key, tuple(bbox))))
+            targets.append(OCRTarget(None if covered else f"{key}@{dpi}", bbox, dpi))
+        return OCRPlan('blocks', targets, skipped)
+
+    @staticmethod
+    def _overlays(pg) -> List[fitz.Rect]:
+        """渲染时图像之外还会画出的内容（文字、矢量图形、图像蒙版）的区域；不可见的文字层不计"""
+        return [fitz.Rect(bbox) for kind, bbox in pg.get_bboxlog()
+                if kind.startswith(('fill-', 'stroke-')) and kind != 'fill-image']
+
+    @staticmethod
+    def _native_dpi(info: dict, bbox: fitz.Rect) -> float:
+        """图像在页面上的实际分辨率：像素宽度 / 显示宽度（英寸）"""
+        width_in = max(bbox.width, 1) / 72
+        height_in = max(bbox.height, 1) / 72
+        return max(info.get('width', 0) / width_in, info.get('height', 0) / height_in)
+
+    @staticmethod
+    def _glyph_dpi(pg) -> Optional[float]:
+        """按页内文本字号估算：使字形高度约 30 像素所需的 DPI（字号越大所需 DPI 越低）"""
+        sizes = [
+            span['size']
+            for block in pg.get_text('dict', flags=0)['blocks']
+            for line in block.get('lines', ())
+            for span in line['spans'] if span['text'].strip()
+        ]
+        if not sizes:
+            return None
+        return 30 / (statistics.median(sizes) * 0.7 / 72)
+
+    def _choose_dpi(self, native_dpi: float, glyph_dpi: Optional[float]) -> int:
+        # 超过图像本身分辨率的渲染不增加信息；字号较大时也无需高 DPI
+        dpi = native_dpi if glyph_dpi is None else min(native_dpi, glyph_dpi)
+        dpi = max(self.min_dpi, min(self.max_dpi, dpi))
+        return int(round(dpi / 10) * 10)
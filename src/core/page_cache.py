@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from utils.cache_paths import get_cache_dir
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    fingerprint TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (fingerprint, page, mode)
+);
+CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages (accessed);
+CREATE TABLE IF NOT EXISTS books (
+    fingerprint TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    total_pages INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (fingerprint, version)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+-- 占用字节数随写入/删除在同一事务内更新，多进程共享同一份计数
+CREATE TRIGGER IF NOT EXISTS pages_bytes_insert AFTER INSERT ON pages BEGIN
+    UPDATE meta SET value = value + NEW.size WHERE name = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS pages_bytes_delete AFTER DELETE ON pages BEGIN
+    UPDATE meta SET value = value - OLD.size WHERE name = 'bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS pages_bytes_update AFTER UPDATE OF size ON pages BEGIN
+    UPDATE meta SET value = value + NEW.size - OLD.size WHERE name = 'bytes';
+END;
+"""
+SCHEMA_VERSION = 3
+
+
+class PageCache:
+    """持久化单页内容缓存（SQLite），键为 文件指纹+页码+提取模式"""
+
+    def __init__(self, db_path: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.db_path = db_path or str(get_cache_dir('pages') / 'pages.db')
+        self.max_bytes = max_bytes or int(float(os.getenv('PAGE_CACHE_MAX_MB', 512)) * 1024 * 1024)
+        self._local = threading.local()
+        with self._connect() as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version < 2:
+                # 旧版 books 表不区分分页版本，直接重建
+                conn.execute('DROP TABLE IF EXISTS books')
+            conn.executescript(_SCHEMA)
+            if version < SCHEMA_VERSION:
+                # 已有数据的库只在升级时全表汇总一次
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('bytes', (SELECT COALESCE(SUM(size), 0) FROM pages))"
+                )
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get_total(self, fingerprint: str, version: int) -> Optional[int]:
+        """总页数随分页方式（version）变化，分别记录"""
+        row = self._connect().execute(
+            'SELECT total_pages FROM books WHERE fingerprint = ? AND version = ?',
+            (fingerprint, version)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_total(self, fingerprint: str, version: int, path: str, total: int):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?)',
+                (fingerprint, version, os.path.abspath(path), total, time.time())
+            )
+
+    def get_pages(self, fingerprint: str, pages: Iterable[int], mode: str) -> Dict[int, str]:
+        pages = list(pages)
+        if not pages:
+            return {}
+        conn = self._connect()
+        rows = conn.execute(
+            'SELECT page, content FROM pages WHERE fingerprint = ? AND mode = ? '
+            'AND page BETWEEN ? AND ?',
+            (fingerprint, mode, min(pages), max(pages))
+        ).fetchall()
+        wanted = set(pages)
+        found = {page: content for page, content in rows if page in wanted}
+        if found:
+            with conn:
+                conn.execute(
+                    'UPDATE pages SET accessed = ? WHERE fingerprint = ? AND mode = ? '
+                    'AND page BETWEEN ? AND ?',
+                    (time.time(), fingerprint, mode, min(found), max(found))
+                )
+        return found
+
+    def put_pages(self, fingerprint: str, mode: str, pages: Dict[int, str]):
+        if not pages:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            # UPSERT 而非 INSERT OR REPLACE：REPLACE 隐式删除不触发删除触发器，字节计数会偏大
+            conn.executemany(
+                'INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (fingerprint, page, mode) DO UPDATE SET '
+                'content = excluded.content, size = excluded.size, accessed = excluded.accessed',
+                [(fingerprint, page, mode, content, len(content.encode('utf-8')), now)
+                 for page, content in pages.items()]
+            )
+        self._evict()
+
+    def purge(self, fingerprint: str) -> int:
+        with self._connect() as conn:
+            removed = conn.execute('DELETE FROM pages WHERE fingerprint = ?', (fingerprint,)).rowcount
+            conn.execute('DELETE FROM books WHERE fingerprint = ?', (fingerprint,))
+        return removed
+
+    def size(self) -> int:
+        row = self._connect().execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()
+        return row[0] if row else 0
+
+    def _evict(self):
+        """超出容量时按最近访问时间淘汰，回落到上限的 90%"""
+        total = self.size()
+        if total <= self.max_bytes:
+            return
+        target = total - int(self.max_bytes * 0.9)
+        conn = self._connect()
+        freed = 0
+        victims = []
+        for fingerprint, page, mode, size in conn.execute(
+                'SELECT fingerprint, page, mode, size FROM pages ORDER BY accessed'):
+            victims.append((fingerprint, page, mode))
+            freed += size
+            if freed >= target:
+                break
+        with conn:
+            conn.executemany(
+                'DELETE FROM pages WHERE fingerprint = ? AND page = ? AND mode = ?', victims
+            )
@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.metrics import metrics
+
+
+class ServerBusyError(RuntimeError):
+    """排队已满，快速拒绝"""
+
+
+class ParseScheduler:
+    """把同步解析任务移出事件循环：全局/单文件并发上限、排队深度、超时与取消"""
+
+    def __init__(self, max_concurrent: int = None, per_file: int = None,
+                 max_queue: int = None, timeout: float = None):
+        self.max_concurrent = max_concurrent or int(os.getenv('MAX_CONCURRENT_PARSES', 4))
+        self.per_file = per_file or int(os.getenv('MAX_PARSES_PER_FILE', 2))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('MAX_PARSE_QUEUE', 16))
+        self.timeout = timeout or float(os.getenv('PARSE_TIMEOUT', 300))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrent,
+                                           thread_name_prefix='parse')
+        self._global = None
+        self._files = {}  # key -> [Semaphore, 引用数]
+        self._pending = 0
+        self.pool = None
+
+        self._worker_slots = None
+
+    def use_pool(self, pool):
+        """
+        改为分派到多进程解析池（func 须为 EbookParser 的方法）。每个进程串行执行，
+        按进程限流：一个执行、一个已提交待执行，避免繁忙进程占满全局槽位
+        """
+        self.pool = pool
+        self.max_concurrent = pool.size * 2
+
+    async def run(self, key: str, func, *args, **kwargs):
+        """在线程池（或 key 所属的解析进程）中执行 func(*args, cancel_event=..., **kwargs)"""
+        task = getattr(func, '__name__', 'task')
+        if self._pending >= self.max_concurrent + self.max_queue:
+            metrics.inc('readbooks_tasks_total', task=task, status='busy')
+            raise ServerBusyError(f"服务繁忙：当前已有 {self._pending} 个解析任务，请稍后重试")
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.max_concurrent)
+
+        key = os.path.abspath(key)
+        gate = self._global
+        if self.pool is not None:
+            if self._worker_slots is None:
+                self._worker_slots = [asyncio.Semaphore(2) for _ in range(self.pool.size)]
+            gate = self._worker_slots[self.pool.worker_for(key)]
+            call, cancel = self._remote_call(key, task, args, kwargs)
+        else:
+            cancel_event = threading.Event()
+            call = functools.partial(
+                asyncio.get_running_loop().run_in_executor, self.executor,
+                functools.partial(func, *args, cancel_event=cancel_event, **kwargs)
+            )
+            cancel = cancel_event.set
+        self._pending += 1
+        file_slot = self._files.setdefault(key, [asyncio.Semaphore(self.per_file), 0])
+        file_slot[1] += 1
+        status = 'error'
+        try:
+            result = await asyncio.wait_for(self._execute(file_slot[0], gate, call, task), self.timeout)
+            status = 'ok'
+            return result
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            cancel()
+            raise TimeoutError(f"解析超时（>{self.timeout:g} 秒）")
+        except asyncio.CancelledError:
+            # 客户端取消或断开：通知工作线程在下一页边界停止
+            status = 'cancelled'
+            cancel()
+            raise
+        finally:
+            metrics.inc('readbooks_tasks_total', task=task, status=status)
+            self._pending -= 1
+            file_slot[1] -= 1
+            if file_slot[1] == 0:
+                self._files.pop(key, None)
+
+    async def _execute(self, file_sem: asyncio.Semaphore, gate: asyncio.Semaphore, call, task: str):
+        queued = time.perf_counter()
+        async with file_sem:
+            async with gate:
+                started = time.perf_counter()
+                metrics.observe('readbooks_queue_wait_seconds', started - queued, task=task)
+                try:
+                    return await call()
+                finally:
+                    metrics.observe('readbooks_task_duration_seconds',
+                                    time.perf_counter() - started, task=task)
+
+    def _remote_call(self, key: str, method: str, args: tuple, kwargs: dict):
+        """取得并发槽位后才提交到解析进程，排队仍由本调度器控制"""
+        handle = {}
+
+        def call():
+            future, handle['cancel'] = self.pool.submit(key, method, args, kwargs)
+            return asyncio.wrap_future(future)
+
+        def cancel():
+            if 'cancel' in handle:
+                handle['cancel']()
+        return call, cancel
+
+    def stats(self) -> dict:
+        return {
+            'pending': self._pending,
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'active_files': len(self._files),
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
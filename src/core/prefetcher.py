@@ -0,0 +1,166 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from utils.metrics import metrics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Stream:
+    """某客户端对某本书的顺序读取状态"""
+    __slots__ = ('next_page', 'job')
+
+    def __init__(self):
+        self.next_page = None
+        self.job = None  # 进行中的预取任务的取消事件
+
+
+class ReadAheadPrefetcher:
+    """
+    顺序预读：同一客户端按页连续阅读同一本书时，在后台低优先级线程中把下一段提前提取进页缓存
+
+    读取位置跳变即取消该流的预取；每个预取任务受页数、CPU 时间（含 tesseract 子进程）、
+    墙钟时间与提取字节数预算限制，前台有解析请求时暂停
+    """
+
+    def __init__(self, parser, max_pages: Optional[int] = None, max_cpu_seconds: Optional[float] = None,
+                 max_bytes: Optional[int] = None, max_streams: int = 64):
+        self.parser = parser
+        self.enabled = os.getenv('PREFETCH_ENABLED', '1').lower() not in ('0', 'false', 'no')
+        self.max_pages = max_pages or int(os.getenv('PREFETCH_MAX_PAGES', 20))
+        self.max_cpu_seconds = max_cpu_seconds or float(os.getenv('PREFETCH_MAX_CPU_SECONDS', 30))
+        self.max_bytes = max_bytes or int(float(os.getenv('PREFETCH_MAX_MB', 16)) * 1024 * 1024)
+        self.max_seconds = float(os.getenv('PREFETCH_MAX_SECONDS', 120))
+        self.max_streams = max_streams
+        self._streams = OrderedDict()  # (client, path, use_ocr) -> _Stream
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def observe(self, client: str, file_path: str, start: int, end: int, use_ocr: bool, total: int):
+        """记录一次读取（start..end 已返回给客户端），顺序读取时安排预取下一段"""
+        if not self.enabled:
+            return
+        key = (client, os.path.abspath(file_path), use_ocr)
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None:
+                stream = self._streams[key] = _Stream()
+                if len(self._streams) > self.max_streams:
+                    _, old = self._streams.popitem(last=False)
+                    self._cancel(old)
+            else:
+                self._streams.move_to_end(key)
+            # 从第 1 页开始或紧接上次读取位置视为顺序阅读
+            sequential = start == 1 or start == stream.next_page
+            self._cancel(stream)
+            stream.next_page = end + 1
+            if not sequential or end >= total:
+                return
+            first = end + 1
+            last = min(total, end + min(self.max_pages, end - start + 1))
+            cancel_event = threading.Event()
+            stream.job = cancel_event
+            self._queue.put((file_path, first, last, use_ocr, cancel_event))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name='prefetch', daemon=True)
+                self._thread.start()
+
+    @staticmethod
+    def _cancel(stream: _Stream):
+        if stream.job is not None:
+            stream.job.set()
+            stream.job = None
+
+    def _worker(self):
+        self._lower_priority()
+        while True:
+            try:
+                job = self._queue.get(timeout=30)
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+            try:
+                self._run(*job)
+            except Exception as e:
+                logger.warning(f"预读失败 {job[0]}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def _lower_priority():
+        """Linux 下 nice 值按线程生效，降低预读线程的调度优先级"""
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+
+    @staticmethod
+    def _cpu_time() -> float:
+        """
+        本线程 CPU 时间加上已结束子进程（pytesseract 调用的 tesseract）的 CPU 时间；
+        子进程部分按进程统计，前台同时 OCR 时会一并计入，预算因而偏保守
+        """
+        cpu = time.thread_time()
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            cpu += usage.ru_utime + usage.ru_stime
+        return cpu
+
+    def _run(self, file_path: str, first: int, last: int, use_ocr: bool, cancel_event: threading.Event):
+        if cancel_event.is_set():
+            metrics.inc('readbooks_prefetch_jobs_total', status='cancelled')
+            return
+        cpu_start = self._cpu_time()
+        wall_start = time.monotonic()
+        state = {'status': 'done'}
+
+        def should_continue(fetched_bytes: int) -> bool:
+            # 前台有解析请求时让路（等待时间不计入墙钟预算）
+            nonlocal wall_start
+            waited = time.monotonic()
+            while self.parser.active_reads and not cancel_event.is_set():
+                cancel_event.wait(0.05)
+            wall_start += time.monotonic() - waited
+            if cancel_event.is_set():
+                state['status'] = 'cancelled'
+                return False
+            if (self._cpu_time() - cpu_start > self.max_cpu_seconds
+                    or time.monotonic() - wall_start > self.max_seconds
+                    or fetched_bytes > self.max_bytes):
+                state['status'] = 'budget'
+                return False
+            return True
+
+        try:
+            fetched = self.parser.prefetch_range(file_path, first, last, use_ocr, cancel_event, should_continue)
+        finally:
+            with self._lock:
+                for stream in self._streams.values():
+                    if stream.job is cancel_event:
+                        stream.job = None
+        metrics.inc('readbooks_prefetch_pages_total', fetched)
+        metrics.inc('readbooks_prefetch_jobs_total', status=state['status'])
+
+    def stats(self) -> dict:
+        with self._lock:
+            active = sum(1 for stream in self._streams.values() if stream.job is not None)
+            return {
+                'enabled': self.enabled,
+                'streams': len(self._streams),
+                'active_jobs': active,
+                'queued': self._queue.qsize(),
+            }
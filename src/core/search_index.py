@@ -0,0 +1,158 @@
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from utils.cache_paths import get_cache_dir
+
+_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5(
+    tokens, content UNINDEXED, page UNINDEXED, tokenize='unicode61'
+);
+CREATE TABLE IF NOT EXISTS indexed_pages (
+    page INTEGER PRIMARY KEY,
+    rowid_ref INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+"""
+# 切分规则变化时递增，旧索引清空后按需重建
+INDEX_VERSION = 2
+# CJK 统一表意文字、假名、谚文按二元组切分，其余按单词切分
+_CJK = r'぀-ヿ㐀-䶿一-鿿豈-﫿가-힯'
+_TOKEN_RE = re.compile(rf'[{_CJK}]+|[^\W{_CJK}]+', re.UNICODE)
+_CJK_RE = re.compile(rf'[{_CJK}]')
+
+
+def tokenize_groups(text: str) -> List[List[str]]:
+    """切分为词组：CJK 连续段展开为重叠二元组（单字保留），其他文字为小写单词"""
+    groups = []
+    for match in _TOKEN_RE.finditer(text):
+        run = match.group(0)
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                groups.append([run])
+            else:
+                groups.append([run[i:i + 2] for i in range(len(run) - 1)])
+        else:
+            groups.append([run.lower()])
+    return groups
+
+
+def index_tokens(text: str) -> str:
+    """
+    写入索引的词元：在 tokenize_groups 之外为每个 CJK 连续段追加末字单字，
+    使每个汉字都是某个词元的开头，单字查询用前缀匹配即可命中二元组的两个位置
+    """
+    tokens = []
+    for group in tokenize_groups(text):
+        tokens.extend(group)
+        if len(group[0]) == 2 and _CJK_RE.match(group[0]):
+            tokens.append(group[-1][1])
+    return ' '.join(tokens)
+
+
+class SearchIndex:
+    """按书（文件指纹）划分的全文索引，SQLite FTS5 + CJK 二元组切分"""
+
+    def __init__(self, index_dir: Optional[str] = None):
+        self.index_dir = index_dir or str(get_cache_dir('search'))
+        self._local = threading.local()
+
+    def _connect(self, fingerprint: str) -> sqlite3.Connection:
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = OrderedDict()
+        conn = conns.get(fingerprint)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.index_dir, f'{fingerprint}.db'), timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            if conn.execute('PRAGMA user_version').fetchone()[0] != INDEX_VERSION:
+                conn.executescript('DROP TABLE IF EXISTS fts; DROP TABLE IF EXISTS indexed_pages;')
+                conn.execute(f'PRAGMA user_version = {INDEX_VERSION}')
+            conn.executescript(_SCHEMA)
+            conns[fingerprint] = conn
+            if len(conns) > 16:
+                conns.popitem(last=False)[1].close()
+        else:
+            conns.move_to_end(fingerprint)
+        return conn
+
+    def add_pages(self, fingerprint: str, pages: Dict[int, str]):
+        """写入页面；已索引的页仅在新内容更长（如 OCR 结果）时替换"""
+        if not pages:
+            return
+        conn = self._connect(fingerprint)
+        existing = dict(conn.execute(
+            'SELECT page, length FROM indexed_pages WHERE page BETWEEN ? AND ?',
+            (min(pages), max(pages))
+        ).fetchall())
+        with conn:
+            for page, content in pages.items():
+                if page in existing and existing[page] >= len(content):
+                    continue
+                if page in existing:
+                    rowid = conn.execute('SELECT rowid_ref FROM indexed_pages WHERE page = ?',
+                                         (page,)).fetchone()[0]
+                    conn.execute('DELETE FROM fts WHERE rowid = ?', (rowid,))
+                tokens = index_tokens(content)
+                cur = conn.execute('INSERT INTO fts (tokens, content, page) VALUES (?, ?, ?)',
+                                   (tokens, content, page))
+                conn.execute('INSERT OR REPLACE INTO indexed_pages VALUES (?, ?, ?)',
+                             (page, cur.lastrowid, len(content)))
+
+    def indexed_pages(self, fingerprint: str) -> int:
+        return self._connect(fingerprint).execute('SELECT COUNT(*) FROM indexed_pages').fetchone()[0]
+
+    def missing_pages(self, fingerprint: str, total: int) -> List[int]:
+        indexed = {row[0] for row in self._connect(fingerprint).execute('SELECT page FROM indexed_pages')}
+        return [p for p in range(1, total + 1) if p not in indexed]
+
+    def search(self, fingerprint: str, query: str, limit: int = 10) -> List[dict]:
+        """按 BM25 排序返回 [{'page', 'score', 'snippet'}]"""
+        groups = tokenize_groups(query)
+        if not groups:
+            return []
+        # 每个词组作为短语匹配，CJK 二元组相邻即还原原始连续文本；单个汉字按前缀匹配
+        # （以该字开头的二元组，或连续段末字的单字词元）
+        phrases = []
+        for group in groups:
+            phrase = '"' + ' '.join(group).replace('"', '""') + '"'
+            if len(group) == 1 and len(group[0]) == 1 and _CJK_RE.match(group[0]):
+                phrase += '*'
+            phrases.append(phrase)
+        match = ' AND '.join(phrases)
+        rows = self._connect(fingerprint).execute(
+            'SELECT page, content, bm25(fts) AS score FROM fts WHERE fts MATCH ? '
+            'ORDER BY score LIMIT ?',
+            (match, limit)
+        ).fetchall()
+        terms = [m.group(0) for m in _TOKEN_RE.finditer(query)]
+        return [
+            {'page': page, 'score': round(-score, 4), 'snippet': self._snippet(content, terms)}
+            for page, content, score in rows
+        ]
+
+    @staticmethod
+    def _snippet(content: str, terms: List[str], width: int = 60) -> str:
+        lowered = content.lower()
+        positions = [lowered.find(term.lower()) for term in terms]
+        positions = [pos for pos in positions if pos >= 0]
+        pos = min(positions) if positions else 0
+        start = max(0, pos - width)
+        end = min(len(content), pos + width * 2)
+        snippet = re.sub(r'\s+', ' ', content[start:end]).strip()
+        return ('…' if start > 0 else '') + snippet + ('…' if end < len(content) else '')
+
+    def purge(self, fingerprint: str):
+        """
+        在事务中清空该书的索引而不删除数据库文件：其他线程、进程缓存的连接
+        仍指向同一文件，删除文件会让它们继续写入已被删除的 inode
+        """
+        if not os.path.exists(os.path.join(self.index_dir, f'{fingerprint}.db')):
+            return
+        conn = self._connect(fingerprint)
+        with conn:
+            conn.execute('DELETE FROM fts')
+            conn.execute('DELETE FROM indexed_pages')
@@ -0,0 +1,119 @@
+import codecs
+import hashlib
+import json
+import mmap
+import os
+import threading
+
+from utils.cache_paths import get_cache_dir, write_atomic
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+_CHUNK = 1 << 20
+
+
+class TxtIndex:
+    """TXT 分页索引：记录每页起始字节偏移，读页只需一次定位+有限读取"""
+
+    def __init__(self, lines_per_page: int = 50):
+        self.lines_per_page = lines_per_page
+        self.index_dir = get_cache_dir('txt_index')
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._build_locks = {}  # path -> Lock，同一文件只由一个线程建索引
+
+    def page_count(self, path: str) -> int:
+        return len(self._get(path)['offsets'])
+
+    def read_page(self, path: str, page: int) -> str:
+        index = self._get(path)
+        offsets = index['offsets']
+        if page < 1 or page > len(offsets):
+            return ""
+        start = offsets[page - 1]
+        end = offsets[page] if page < len(offsets) else index['size']
+        with open(path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = mm[start:end]
+        text = data.decode(index['encoding'], errors='replace')
+        return text.replace('\r\n', '\n')
+
+    def _get(self, path: str) -> dict:
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = [st.st_mtime_ns, st.st_size]
+        with self._lock:
+            index = self._indexes.get(path)
+            if index and index['stamp'] == stamp:
+                return index
+            build_lock = self._build_locks.setdefault(path, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                index = self._indexes.get(path)
+                if index and index['stamp'] == stamp:
+                    return index
+            index_file = self.index_dir / (hashlib.sha1(path.encode('utf-8')).hexdigest() + '.json')
+            index = self._load(index_file, stamp)
+            if index is None:
+                index = self._build(path, stamp)
+                write_atomic(index_file, json.dumps(index))
+            with self._lock:
+                self._indexes[path] = index
+        return index
+
+    def _load(self, index_file, stamp):
+        try:
+            index = json.loads(index_file.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+        if index.get('stamp') != stamp or index.get('lines_per_page') != self.lines_per_page:
+            return None
+        return index
+
+    def _build(self, path: str, stamp) -> dict:
+        """扫描一次文件：识别编码并记录每页起始偏移"""
+        index = {'stamp': stamp, 'size': stamp[1], 'lines_per_page': self.lines_per_page,
+                 'encoding': 'utf-8', 'offsets': []}
+        if stamp[1] == 0:
+            return index
+        with open(path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            encoding, start = self._detect_encoding(mm)
+            newline = '\n'.encode(encoding)
+            width = len(newline)
+            offsets = [start] if start < len(mm) else []
+            lines = 0
+            pos = mm.find(newline, start)
+            while pos != -1:
+                if (pos - start) % width:
+                    # UTF-16 未对齐的匹配不是换行符
+                    pos = mm.find(newline, pos + 1)
+                    continue
+                lines += 1
+                nxt = pos + width
+                if lines % self.lines_per_page == 0 and nxt < len(mm):
+                    offsets.append(nxt)
+                pos = mm.find(newline, nxt)
+        index['encoding'] = encoding
+        index['offsets'] = offsets
+        return index
+
+    @staticmethod
+    def _detect_encoding(mm):
+        """BOM 优先；否则校验整文件 UTF-8，失败回退 GB18030"""
+        head = mm[:4]
+        for bom, encoding in _BOMS:
+            if head.startswith(bom):
+                return encoding, len(bom)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            for i in range(0, len(mm), _CHUNK):
+                decoder.decode(mm[i:i + _CHUNK])
+            decoder.decode(b'', final=True)
+            return 'utf-8', 0
+        except UnicodeDecodeError:
+            return 'gb18030', 0
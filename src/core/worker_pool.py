@@ -0,0 +1,355 @@
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import signal
+import threading
+import time
+import zlib
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCrashedError(RuntimeError):
+    """解析进程在任务完成前退出"""
+
+
+class _CancelToken:
+    """跨进程取消标记：主进程经控制队列发来的取消任务号记入集合，解析进程按页边界检查"""
+
+    def __init__(self, cancelled: set, task_id: int):
+        self._cancelled = cancelled
+        self.task_id = task_id
+
+    def is_set(self) -> bool:
+        return self.task_id in self._cancelled
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _portable_error(error: Exception) -> Exception:
+    """异常需经队列回传主进程，无法序列化的改为 RuntimeError"""
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+def _worker_main(index: int, tasks, control, results, warmup: bool, heartbeat: float):
+    """
+    解析进程入口：串行执行主进程分派的 EbookParser 方法调用
+
+    控制队列由单独的线程处理，任务执行期间也能收到取消与缓存失效通知
+    """
+    # Ctrl+C 由主进程统一处理，解析进程随后收到退出消息
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from core.ebook_parser import EbookParser, ParseCancelledError
+
+    # 每个进程只解析分派给自己的文件，不再嵌套进程池
+    parser = EbookParser(workers=1)
+    if warmup:
+        parser.warmup()
+    parent = os.getppid()
+    state = {'task': None, 'started': None}
+    cancelled = set()
+
+    def listen():
+        while True:
+            kind, arg = control.get()
+            if kind == 'cancel':
+                cancelled.add(arg)
+            elif kind == 'invalidate':
+                parser.invalidate_memory(arg)
+
+    def beat():
+        while True:
+            if os.getppid() != parent:
+                # 主进程已退出
+                os._exit(0)
+            task, started = state['task'], state['started']
+            results.put(('heartbeat', index, {
+                'pid': os.getpid(),
+                'current_task': task,
+                'busy_seconds': round(time.monotonic() - started, 3) if started else 0.0,
+                'peak_rss_mb': _peak_rss_mb(),
+                # 只含进程内缓存；共享的页缓存由主进程统计
+                'cache': {'range_cache': parser.cache.stats(), 'prefetch': parser.prefetcher.stats()},
+                'metrics': metrics.dump(),
+            }))
+            time.sleep(heartbeat)
+
+    threading.Thread(target=beat, name='heartbeat', daemon=True).start()
+    threading.Thread(target=listen, name='control', daemon=True).start()
+    while True:
+        message = tasks.get()
+        if message is None:
+            break
+        task_id, method, args, kwargs, progress = message
+        if progress:
+            kwargs['on_page'] = lambda done, total, task_id=task_id: results.put(
+                ('progress', task_id, done, total))
+        state['task'], state['started'] = method, time.monotonic()
+        try:
+            if task_id in cancelled:
+                # 排队期间已被取消
+                raise ParseCancelledError("解析已取消")
+            result = getattr(parser, method)(*args, cancel_event=_CancelToken(cancelled, task_id), **kwargs)
+            results.put(('done', task_id, result))
+        except Exception as e:
+            results.put(('error', task_id, _portable_error(e)))
+        finally:
+            state['task'], state['started'] = None, None
+            # 任务按任务号顺序执行，不大于当前任务号的取消记录不再有用
+            cancelled.difference_update([t for t in list(cancelled) if t <= task_id])
+    parser.close()
+
+
+class _Worker:
+    """主进程侧的解析进程记录：进程、任务队列、进行中的任务与计数"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.tasks = None
+        self.control = None
+        self.pending: Dict[int, tuple] = {}  # 任务号 -> (Future, on_page)
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.last_heartbeat = None
+        self.spawned = 0.0
+        self.status = {}
+
+
+class ParseWorkerPool:
+    """
+    多进程解析池：按文件绝对路径的哈希把请求固定分派到同一进程，文档句柄、
+    内存范围缓存与 OCR 结果缓存留在该进程内复用；页缓存、书籍元数据、全文索引与
+    EPUB 页表本就是磁盘上的共享存储，各进程提取的页互相可见
+
+    每个进程串行执行任务，进程数即解析并发度
+    """
+    RESTART_BACKOFF = 5.0
+
+    def __init__(self, size: int, warmup: bool = False, heartbeat: float = None):
+        self.size = size
+        self.warmup = warmup
+        self.heartbeat = heartbeat or float(os.getenv('WORKER_HEARTBEAT', 5))
+        # 解析进程不继承主进程的事件循环、线程与 SQLite 连接
+        self._ctx = multiprocessing.get_context('spawn')
+        self._results = self._ctx.Queue()
+        self._workers = [_Worker(i) for i in range(size)]
+        self._owner = {}  # 任务号 -> 进程序号
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._collector = None
+
+    def start(self):
+        for worker in self._workers:
+            self._spawn(worker)
+        self._collector = threading.Thread(target=self._collect, name='worker-results', daemon=True)
+        self._collector.start()
+        logger.info(f"已启动 {self.size} 个解析进程")
+
+    def _spawn(self, worker: _Worker):
+        worker.tasks = self._ctx.Queue()
+        worker.control = self._ctx.Queue()
+        worker.last_heartbeat = None
+        worker.spawned = time.monotonic()
+        worker.status = {}
+        worker.process = self._ctx.Process(
+            target=_worker_main, name=f'parse-worker-{worker.index}', daemon=True,
+            args=(worker.index, worker.tasks, worker.control, self._results,
+                  self.warmup, self.heartbeat)
+        )
+        worker.process.start()
+
+    def worker_for(self, path: str) -> int:
+        """稳定哈希（不受 PYTHONHASHSEED 影响），进程重启后分派关系不变"""
+        return zlib.crc32(os.path.abspath(path).encode('utf-8')) % self.size
+
+    def submit(self, key: str, method: str, args: tuple, kwargs: dict):
+        """
+        把 EbookParser.method(*args, **kwargs) 分派到 key 所属进程，返回 (Future, 取消函数)
+
+        kwargs 中的 on_page 回调留在主进程，由解析进程回传进度后调用
+        """
+        kwargs = dict(kwargs)
+        on_page: Optional[Callable[[int, int], None]] = kwargs.pop('on_page', None)
+        worker = self._workers[self.worker_for(key)]
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("解析进程池已关闭")
+            self._next_id += 1
+            task_id = self._next_id
+            worker.pending[task_id] = (future, on_page)
+            self._owner[task_id] = worker.index
+            worker.tasks.put((task_id, method, args, kwargs, on_page is not None))
+
+        def cancel():
+            with self._lock:
+                if task_id in worker.pending:
+                    worker.control.put(('cancel', task_id))
+        return future, cancel
+
+    def broadcast_invalidate(self, fingerprint: str):
+        """通知所有解析进程丢弃该书的进程内缓存（清除页缓存后调用）"""
+        with self._lock:
+            for worker in self._workers:
+                worker.control.put(('invalidate', fingerprint))
+
+    def _collect(self):
+        """汇总各进程回传的结果、进度与心跳，并检查进程存活"""
+        last_check = time.monotonic()
+        while not self._closed:
+            try:
+                message = self._results.get(timeout=1)
+            except queue.Empty:
+                message = None
+            except (EOFError, OSError):
+                break
+            if message is not None:
+                try:
+                    self._dispatch(message)
+                except Exception as e:
+                    logger.warning(f"处理解析进程消息失败: {str(e)}")
+            if time.monotonic() - last_check >= 1:
+                last_check = time.monotonic()
+                self._check_workers()
+
+    def _dispatch(self, message: tuple):
+        kind = message[0]
+        if kind == 'heartbeat':
+            _, index, status = message
+            worker = self._workers[index]
+            if status['pid'] == getattr(worker.process, 'pid', None):
+                worker.last_heartbeat = time.monotonic()
+                worker.status = status
+            return
+        task_id = message[1]
+        with self._lock:
+            index = self._owner.get(task_id)
+            if index is None:
+                return
+            worker = self._workers[index]
+            if kind == 'progress':
+                entry = worker.pending.get(task_id)
+            else:
+                self._owner.pop(task_id, None)
+                entry = worker.pending.pop(task_id, None)
+                if kind == 'done':
+                    worker.completed += 1
+                else:
+                    worker.failed += 1
+        if entry is None:
+            return
+        future, on_page = entry
+        if kind == 'progress':
+            if on_page is not None:
+                on_page(message[2], message[3])
+            return
+        try:
+            if kind == 'done':
+                future.set_result(message[2])
+            else:
+                future.set_exception(message[2])
+        except InvalidStateError:
+            # 调用方已取消等待
+            pass
+
+    def _check_workers(self):
+        """进程异常退出时让其未完成任务失败，并重新拉起进程（两次启动至少间隔 RESTART_BACKOFF 秒）"""
+        for worker in self._workers:
+            if self._closed or worker.process.is_alive():
+                continue
+            with self._lock:
+                lost = list(worker.pending.values())
+                for task_id in worker.pending:
+                    self._owner.pop(task_id, None)
+                worker.failed += len(lost)
+                worker.pending.clear()
+                exitcode = worker.process.exitcode
+                restart = time.monotonic() - worker.spawned >= self.RESTART_BACKOFF
+                if restart:
+                    worker.restarts += 1
+                    self._spawn(worker)
+            if restart or lost:
+                logger.error(f"解析进程 {worker.index} 异常退出（exitcode={exitcode}），"
+                             f"{'已重启' if restart else '稍后重启'}，{len(lost)} 个任务失败")
+            for future, _ in lost:
+                try:
+                    future.set_exception(WorkerCrashedError(f"解析进程 {worker.index} 异常退出"))
+                except InvalidStateError:
+                    pass
+
+    def stats(self) -> List[dict]:
+        """逐进程的健康状况与负载；心跳超过 3 个周期未到视为不健康"""
+        now = time.monotonic()
+        result = []
+        with self._lock:
+            for worker in self._workers:
+                age = None if worker.last_heartbeat is None else now - worker.last_heartbeat
+                alive = worker.process is not None and worker.process.is_alive()
+                result.append({
+                    'worker': worker.index,
+                    'pid': worker.process.pid if worker.process else None,
+                    'alive': alive,
+                    'healthy': alive and age is not None and age < self.heartbeat * 3,
+                    'heartbeat_age': round(age, 3) if age is not None else None,
+                    'in_flight': len(worker.pending),
+                    'completed': worker.completed,
+                    'failed': worker.failed,
+                    'restarts': worker.restarts,
+                    **{k: v for k, v in worker.status.items() if k not in ('pid', 'metrics')},
+                })
+                if 'metrics' in worker.status:
+                    result[-1]['metrics'] = metrics.summarize(worker.status['metrics'])
+        return result
+
+    def metric_dumps(self) -> List[tuple]:
+        """各解析进程最近一次心跳上报的指标原始数据：[({'worker': 序号}, dump), ...]"""
+        with self._lock:
+            return [({'worker': worker.index}, worker.status['metrics'])
+                    for worker in self._workers if 'metrics' in worker.status]
+
+    def publish_metrics(self):
+        """把逐进程的存活与负载写入本进程指标（Prometheus 导出前调用）"""
+        for status in self.stats():
+            worker = status['worker']
+            metrics.set_gauge('readbooks_worker_up', int(status['healthy']), worker=worker)
+            metrics.set_gauge('readbooks_worker_in_flight', status['in_flight'], worker=worker)
+            metrics.set_total('readbooks_worker_tasks_total', status['completed'], worker=worker, status='ok')
+            metrics.set_total('readbooks_worker_tasks_total', status['failed'], worker=worker, status='error')
+
+    def close(self, timeout: float = 5):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for worker in self._workers:
+            try:
+                worker.tasks.put(None)
+            except (OSError, ValueError):
+                pass
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.terminate()
@@ -1,24 +1,56 @@
+import time
+# 启动计时起点：尽量早于其他导入
+_PROCESS_START = time.perf_counter()
 import argparse
+import asyncio
+import atexit
+import base64
+import json
 import os
 import sys
 import logging
+import threading
+import uuid
 from dotenv import load_dotenv
-from fastmcp import FastMCP
-from typing import Annotated
-from pydantic import Field
+from fastmcp import Context, FastMCP
+from typing import Annotated, Callable, List, Literal, Optional
+from pydantic import BaseModel, Field
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
 from core.ebook_parser import EbookParser
+from core.parse_scheduler import ParseScheduler, ServerBusyError
+from core.worker_pool import ParseWorkerPool
+from utils.file_convert import PreconvertQueue
+from utils.metrics import metrics
 
-# 配置日志
+# 配置日志（输出到 stderr，stdout 留给 stdio 传输）
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    stream=sys.stdout
+    stream=sys.stderr
 )
 load_dotenv()
 
+class BatchJob(BaseModel):
+    file_path: Annotated[str, Field(description="电子书文件路径", max_length=255)]
+    start_page: Annotated[int, Field(description="起始页码", ge=1)]
+    end_page: Annotated[Optional[int], Field(description="结束页码，留空表示读到末尾", ge=1)] = None
+    use_ocr: Annotated[bool, Field(description="是否启用OCR识别")] = False
+
+
 class EbookService:
     def __init__(self):
-        self.ebook_parser = EbookParser()
+        self._ebook_parser = None
+        self._parser_lock = threading.Lock()
+        self.startup_seconds = None
+        self.scheduler = ParseScheduler()
+        self.pool = None
+        self.stream_max_chars = int(os.getenv('STREAM_MAX_CHARS', 100000))
+        self.preconvert = PreconvertQueue()
+        self._index_jobs = {}
+        if os.getenv('PRECONVERT_DIR'):
+            # 扫描在后台转换线程中进行，不拖慢启动
+            self.preconvert.scan_library(os.getenv('PRECONVERT_DIR'))
         self.mcp = FastMCP(
             "EbookReader",
             dependencies=["pymupdf", "python-docx", "pychm", "mobi"],
@@ -27,6 +59,26 @@ class EbookService:
         )
         self._register_tools()
 
+    @property
+    def ebook_parser(self) -> EbookParser:
+        """解析器在第一次请求时创建，不计入服务启动时间"""
+        if self._ebook_parser is None:
+            with self._parser_lock:
+                if self._ebook_parser is None:
+                    self._ebook_parser = EbookParser()
+        return self._ebook_parser
+
+    def close(self):
+        """退出时释放本进程的解析器（文档句柄与 OCR 引擎）"""
+        if self._ebook_parser is not None:
+            self._ebook_parser.close()
+
+    def warmup(self):
+        """预加载解析器、各格式依赖与 OCR 引擎，首个请求不再承担导入开销"""
+        start = time.perf_counter()
+        loaded = self.ebook_parser.warmup()
+        logging.info(f"预加载完成，用时 {time.perf_counter() - start:.2f} 秒: {', '.join(loaded)}")
+
     def _register_tools(self):
         """完整工具注解实现"""
         @self.mcp.tool(
@@ -40,8 +92,10 @@ class EbookService:
         async def parse_ebook(
             file_path: Annotated[str, Field(description="电子书文件路径", max_length=255)],
             start_page: Annotated[int, Field(description="起始页码", ge=1)],
-            end_page: Annotated[int, Field(description="结束页码", ge=1)],
-            use_ocr: Annotated[bool, Field(description="是否启用OCR识别")] = False
+            end_page: Annotated[Optional[int], Field(description="结束页码，留空表示读到末尾", ge=1)] = None,
+            use_ocr: Annotated[bool, Field(description="是否启用OCR识别")] = False,
+            max_chars: Annotated[Optional[int], Field(description="单次返回的字符预算，0 表示不限制", ge=0)] = None,
+            ctx: Context = None
         ) -> str:
             """
             解析6种格式电子书（PDF/EPUB/Word/MOBI/TXT/CHM）
@@ -49,24 +103,397 @@ class EbookService:
             参数:
                 file_path: 电子书文件绝对路径
                 start_page: 起始页码(从1开始)
-                end_page: 结束页码
+                end_page: 结束页码，留空则读到末尾
                 use_ocr: 是否对扫描版PDF启用OCR
+                max_chars: 字符预算，超出时在页边界截断，并在末尾给出续读游标与资源URI
             
             返回:
                 解析后的文本内容
             """
             try:
                 logging.info(f"开始解析电子书，文件路径: {file_path}，起始页码: {start_page}，结束页码: {end_page}，是否使用OCR: {use_ocr}")
-                # 调用 EbookParser 的 parse_range 方法
-                result = self.ebook_parser.parse_range(file_path, start_page, end_page, use_ocr)
+                result = await self._read_chunk(file_path, start_page, end_page, use_ocr, max_chars, ctx)
                 logging.info(f"电子书解析完成，文件路径: {file_path}")
                 return result
+            except ServerBusyError as e:
+                logging.warning(f"拒绝解析请求，文件路径: {file_path}，原因: {str(e)}")
+                raise ValueError(str(e))
             except Exception as e:
                 logging.error(f"解析电子书失败，文件路径: {file_path}，错误信息: {str(e)}", exc_info=True)
-                raise ValueError(f"解析电子书失败: {str(e)}")   
+                raise ValueError(f"解析电子书失败: {str(e)}")
+
+        @self.mcp.resource(
+            "ebook://stream/{cursor}",
+            name="ebook_stream",
+            description="按续读游标读取 parse_ebook 截断后的剩余内容",
+            mime_type="text/plain"
+        )
+        async def ebook_stream(cursor: str) -> str:
+            state = self._decode_cursor(cursor)
+            return await self._read_chunk(
+                state['file_path'], state['start_page'], state['end_page'],
+                state['use_ocr'], state['max_chars'], client=state.get('client')
+            )
+
+        @self.mcp.tool(
+            name="manage_cache",
+            annotations={
+                "title": "页缓存管理工具",
+                "readOnlyHint": False,
+                "destructiveHint": True
+            }
+        )
+        async def manage_cache(
+            action: Annotated[Literal["warm", "purge", "stats"], Field(description="warm=预热整本书，purge=清除该书缓存，stats=查看缓存统计")],
+            file_path: Annotated[Optional[str], Field(description="电子书文件路径，warm/purge 时必填", max_length=255)] = None,
+            use_ocr: Annotated[bool, Field(description="预热时是否启用OCR识别")] = False
+        ) -> str:
+            """
+            预热或清除一本书的持久化页缓存，或查看缓存统计
+
+            参数:
+                action: warm 预先提取全部页面写入缓存；purge 删除该书所有缓存页；
+                        stats 返回命中/未命中/淘汰次数与占用字节
+                file_path: 电子书文件绝对路径，stats 时不需要
+                use_ocr: 预热时是否对扫描版PDF启用OCR
+
+            返回:
+                操作结果说明
+            """
+            if action != "stats" and not file_path:
+                raise ValueError(f"{action} 操作需要提供 file_path")
+            try:
+                logging.info(f"页缓存操作: {action}，文件路径: {file_path}，是否使用OCR: {use_ocr}")
+                if action == "stats":
+                    return json.dumps(self._cache_stats(), ensure_ascii=False)
+                if action == "purge":
+                    # 计算文件指纹需要读取整个文件，不在事件循环中执行
+                    removed = await asyncio.to_thread(self._purge, file_path)
+                    return f"已清除 {removed} 个缓存页"
+                extracted = await self.scheduler.run(
+                    file_path, self.ebook_parser.warm_cache, file_path, use_ocr
+                )
+                return f"预热完成，新提取 {extracted} 页"
+            except ServerBusyError as e:
+                raise ValueError(str(e))
+            except Exception as e:
+                logging.error(f"页缓存操作失败，文件路径: {file_path}，错误信息: {str(e)}", exc_info=True)
+                raise ValueError(f"页缓存操作失败: {str(e)}")
+
+        @self.mcp.tool(
+            name="preconvert_library",
+            annotations={
+                "title": "书库预转换工具",
+                "readOnlyHint": False,
+                "destructiveHint": False
+            }
+        )
+        async def preconvert_library(
+            directory: Annotated[str, Field(description="书库目录路径", max_length=255)]
+        ) -> str:
+            """
+            在后台预先转换目录下需要转换的文件（.doc，以及缺少直接读取库的 DOCX/CHM/MOBI），
+            首次阅读时无需等待转换
+
+            参数:
+                directory: 书库目录绝对路径（递归扫描）
+
+            返回:
+                入队文件数与当前排队数
+            """
+            if not await asyncio.to_thread(os.path.isdir, directory):
+                raise ValueError(f"目录不存在: {directory}")
+            # 书库可能很大或位于网络存储，扫描不在事件循环中进行
+            count = await asyncio.to_thread(self.preconvert.enqueue_library, directory)
+            logging.info(f"书库预转换入队 {count} 个文件，目录: {directory}")
+            return f"已加入预转换队列 {count} 个文件，当前排队 {self.preconvert.pending()} 个"
+
+        @self.mcp.tool(
+            name="search_ebook",
+            annotations={
+                "title": "电子书全文检索工具",
+                "readOnlyHint": True,
+                "destructiveHint": False
+            }
+        )
+        async def search_ebook(
+            file_path: Annotated[str, Field(description="电子书文件路径", max_length=255)],
+            query: Annotated[str, Field(description="检索词，支持中英文", min_length=1, max_length=200)],
+            limit: Annotated[int, Field(description="最多返回的结果数", ge=1, le=50)] = 10,
+            build_index: Annotated[bool, Field(description="索引不完整时是否在后台补全整本书索引")] = True
+        ) -> str:
+            """
+            在电子书全文索引中检索，返回按相关度排序的页码与摘要
+
+            参数:
+                file_path: 电子书文件绝对路径
+                query: 检索词（中文按二元组匹配连续文本）
+                limit: 最多返回的结果数
+                build_index: 索引未覆盖全书时是否启动后台索引任务
+
+            返回:
+                JSON：results（page/score/snippet）、indexed_pages、total_pages、indexing
+            """
+            try:
+                logging.info(f"全文检索，文件路径: {file_path}，检索词: {query}")
+                result = await asyncio.to_thread(self.ebook_parser.search, file_path, query, limit)
+                result['indexing'] = file_path in self._index_jobs
+                if build_index and result['indexed_pages'] < result['total_pages']:
+                    result['indexing'] = self._start_index_job(file_path)
+                return json.dumps(result, ensure_ascii=False)
+            except Exception as e:
+                logging.error(f"全文检索失败，文件路径: {file_path}，错误信息: {str(e)}", exc_info=True)
+                raise ValueError(f"全文检索失败: {str(e)}")
+
+        @self.mcp.tool(
+            name="get_book_info",
+            annotations={
+                "title": "书籍信息工具",
+                "readOnlyHint": True,
+                "destructiveHint": False
+            }
+        )
+        async def get_book_info(
+            file_path: Annotated[str, Field(description="电子书文件路径", max_length=255)]
+        ) -> str:
+            """
+            获取书籍的页数、目录（含页码）、逐页类型（text/scanned/mixed/empty）和文件指纹，
+            便于按章节规划阅读范围；页数很多时逐页类型为抽样估计（见 page_types_sampled）；
+            结果持久化，文件未修改时几乎零开销
+
+            参数:
+                file_path: 电子书文件绝对路径
+
+            返回:
+                JSON 格式的书籍信息
+            """
+            try:
+                logging.info(f"获取书籍信息，文件路径: {file_path}")
+                info = await self.scheduler.run(file_path, self.ebook_parser.book_info, file_path)
+                return json.dumps(info, ensure_ascii=False)
+            except ServerBusyError as e:
+                raise ValueError(str(e))
+            except Exception as e:
+                logging.error(f"获取书籍信息失败，文件路径: {file_path}，错误信息: {str(e)}", exc_info=True)
+                raise ValueError(f"获取书籍信息失败: {str(e)}")
+
+        @self.mcp.tool(
+            name="parse_batch",
+            annotations={
+                "title": "批量解析工具",
+                "readOnlyHint": True,
+                "destructiveHint": False
+            }
+        )
+        async def parse_batch(
+            jobs: Annotated[List[BatchJob], Field(description="解析任务列表", min_length=1, max_length=100)],
+            max_chars: Annotated[Optional[int], Field(description="每个任务的字符预算，0 表示不限制", ge=0)] = None
+        ) -> str:
+            """
+            一次调用解析多本书的多个页码范围：同一文件的任务合并执行以复用文档与缓存，
+            不同文件并行调度；单个任务失败不影响其余任务
+
+            参数:
+                jobs: 任务列表，每项包含 file_path、start_page、end_page、use_ocr
+                max_chars: 每个任务的字符预算，超出时在页边界截断并给出 next_page
+
+            返回:
+                JSON 数组，与 jobs 顺序一致：ok、content、next_page 或 error
+            """
+            if max_chars is None:
+                max_chars = self.stream_max_chars
+            logging.info(f"批量解析 {len(jobs)} 个任务")
+            groups = {}
+            for index, job in enumerate(jobs):
+                groups.setdefault(os.path.abspath(job.file_path), []).append((index, job.model_dump()))
+
+            # 同时提交的文件数不超过调度器的并发上限，整批不会占满排队深度而被自身拒绝
+            limit = asyncio.Semaphore(self.scheduler.max_concurrent)
+
+            async def run_group(file_path, items):
+                # 同一文件的任务依次执行、复用文档句柄；每个任务单独调度，各有各的超时，
+                # 一个任务超时或失败不影响已完成与后续的任务
+                outcomes = []
+                async with limit:
+                    for index, job in items:
+                        try:
+                            content, next_page = await self.scheduler.run(
+                                file_path, self.ebook_parser.read_chunk,
+                                job['file_path'], job['start_page'], job.get('end_page'),
+                                job.get('use_ocr', False), max_chars
+                            )
+                            outcomes.append((index, {'ok': True, 'content': content, 'next_page': next_page}))
+                        except Exception as e:
+                            outcomes.append((index, {'ok': False, 'error': str(e)}))
+                return outcomes
+
+            results = [None] * len(jobs)
+            for group in await asyncio.gather(*(run_group(f, items) for f, items in groups.items())):
+                for index, outcome in group:
+                    results[index] = {**jobs[index].model_dump(), **outcome}
+            failed = sum(1 for r in results if not r['ok'])
+            logging.info(f"批量解析完成，成功 {len(jobs) - failed} 个，失败 {failed} 个")
+            return json.dumps(results, ensure_ascii=False)
+
+        @self.mcp.tool(
+            name="server_stats",
+            annotations={
+                "title": "服务运行统计",
+                "readOnlyHint": True,
+                "destructiveHint": False
+            }
+        )
+        async def server_stats() -> str:
+            """
+            查看服务运行统计：各处理阶段（打开文档、文本提取、渲染、OCR 各步骤、格式转换、
+            缓存查询）的耗时分布与异常次数，缓存命中率，任务排队与并发情况；
+            多进程模式下另含各解析进程的健康状况、负载与各自的阶段统计
+
+            返回:
+                JSON 格式的统计信息
+            """
+            stats = {
+                'startup_seconds': self.startup_seconds,
+                'metrics': metrics.snapshot(),
+                'cache': self._cache_stats(),
+                'scheduler': self.scheduler.stats(),
+                'preconvert_pending': self.preconvert.pending(),
+            }
+            if self.pool is not None:
+                stats['workers'] = self.pool.stats()
+            return json.dumps(stats, ensure_ascii=False)
+
+        # SSE 模式下以 Prometheus 文本格式暴露同一份指标
+        @self.mcp.custom_route("/metrics", methods=["GET"])
+        async def prometheus_metrics(request: Request) -> Response:
+            remote = []
+            if self.pool is not None:
+                self.pool.publish_metrics()
+                # 各阶段耗时等指标记录在解析进程中，随心跳上报后按 worker 标签合并导出
+                remote = self.pool.metric_dumps()
+            return PlainTextResponse(metrics.render_prometheus(remote),
+                                     media_type="text/plain; version=0.0.4")
+
+        # 负载均衡/编排探活：任一解析进程不健康时返回 503
+        @self.mcp.custom_route("/health", methods=["GET"])
+        async def health(request: Request) -> Response:
+            if self.pool is None:
+                return JSONResponse({'status': 'ok', 'mode': 'single', 'scheduler': self.scheduler.stats()})
+            workers = [
+                {k: v for k, v in status.items() if k not in ('cache', 'metrics')}
+                for status in self.pool.stats()
+            ]
+            healthy = all(w['healthy'] for w in workers)
+            return JSONResponse({'status': 'ok' if healthy else 'degraded', 'mode': 'workers',
+                                 'scheduler': self.scheduler.stats(), 'workers': workers},
+                                status_code=200 if healthy else 503)
+
+    def _purge(self, file_path: str) -> int:
+        """清除磁盘缓存；多进程模式下另通知各解析进程丢弃内存中的该书缓存"""
+        removed = self.ebook_parser.purge_cache(file_path)
+        if self.pool is not None:
+            self.pool.broadcast_invalidate(self.ebook_parser.metadata.fingerprint(file_path))
+        return removed
+
+    def _cache_stats(self) -> dict:
+        """多进程模式下内存缓存在各解析进程中，按进程列出"""
+        stats = self.ebook_parser.cache_stats()
+        if self.pool is not None:
+            stats['workers'] = {s['worker']: s.get('cache') for s in self.pool.stats()}
+        return stats
+
+    def _start_index_job(self, file_path: str) -> bool:
+        """启动后台整本书索引任务，同一文件同时只有一个"""
+        if file_path in self._index_jobs:
+            return True
+
+        async def job():
+            try:
+                count = await self.scheduler.run(file_path, self.ebook_parser.index_book, file_path)
+                logging.info(f"全文索引完成，新索引 {count} 页，文件路径: {file_path}")
+            except Exception as e:
+                logging.warning(f"全文索引任务失败，文件路径: {file_path}，原因: {str(e)}")
+            finally:
+                self._index_jobs.pop(file_path, None)
+
+        self._index_jobs[file_path] = asyncio.create_task(job())
+        return True
+
+    @staticmethod
+    def _progress_reporter(ctx: Optional[Context]) -> Optional[Callable[[int, int], None]]:
+        """把解析线程中的逐页进度转发给客户端；无请求上下文时不上报"""
+        if ctx is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return lambda done, total: asyncio.run_coroutine_threadsafe(
+            ctx.report_progress(done, total), loop)
+
+    async def _read_chunk(self, file_path: str, start_page: int, end_page: Optional[int],
+                          use_ocr: bool, max_chars: Optional[int], ctx: Context = None,
+                          client: Optional[str] = None) -> str:
+        """
+        在线程池中按字符预算读取一段，逐页上报进度，未读完时附加续读游标；
+        游标记录发起读取的客户端，沿游标续读时顺序预读仍按该客户端识别
+        """
+        client = client or self._client_key(ctx)
+        if max_chars is None:
+            max_chars = self.stream_max_chars
+        text, next_page = await self.scheduler.run(
+            file_path, self.ebook_parser.read_chunk,
+            file_path, start_page, end_page, use_ocr, max_chars,
+            on_page=self._progress_reporter(ctx), client=client
+        )
+        if next_page is None:
+            return text
+        cursor = self._encode_cursor({
+            'file_path': file_path, 'start_page': next_page, 'end_page': end_page,
+            'use_ocr': use_ocr, 'max_chars': max_chars, 'client': client
+        })
+        return (f"{text}\n=== 未完待续：从第 {next_page} 页继续，"
+                f"next_cursor={cursor}，resource=ebook://stream/{cursor} ===")
+
+    @staticmethod
+    def _client_key(ctx: Optional[Context]) -> str:
+        """顺序预读按客户端区分阅读位置；无上下文且游标未携带客户端时，每条游标链各用一个新键"""
+        if ctx is None:
+            return f"cursor-{uuid.uuid4().hex[:12]}"
+        try:
+            return ctx.client_id or f"session-{id(ctx.session)}"
+        except Exception:
+            return 'anonymous'
+
+    @staticmethod
+    def _encode_cursor(state: dict) -> str:
+        raw = json.dumps(state, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> dict:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            return json.loads(raw.decode('utf-8'))
+        except ValueError:
+            raise ValueError(f"无效的续读游标: {cursor}")
+
+    def start_workers(self, workers: int, warmup: bool = False):
+        """
+        多进程模式：解析任务按文件分派到 workers 个解析进程，本进程只负责 MCP 协议与调度，
+        解析吞吐随 CPU 核数扩展
+        """
+        self.pool = ParseWorkerPool(workers, warmup=warmup)
+        self.pool.start()
+        self.scheduler.use_pool(self.pool)
+        atexit.register(self.pool.close)
 
-    def run(self, transport="stdio", port=8000):
-        """启动MCP服务"""
+    def run(self, transport="stdio", port=8000, warmup=False, workers=1):
+        """启动MCP服务；workers>1 时启用多进程解析"""
+        atexit.register(self.close)
+        if workers > 1:
+            self.start_workers(workers, warmup)
+        elif warmup:
+            self.warmup()
+        self.startup_seconds = round(time.perf_counter() - _PROCESS_START, 3)
+        logging.info(f"服务启动用时 {self.startup_seconds} 秒（进程启动至开始监听）")
         if transport == "stdio":
             logging.info(f"Starting MCP service in stdio mode on port {port}")
             self.mcp.run(transport=transport)
@@ -78,5 +505,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--mode", choices=["sse", "stdio"], default=os.getenv("TRANSPORT_MODE"))
     parser.add_argument("--port", type=int, default=os.getenv("SSE_PORT", 8000))
+    parser.add_argument("--warmup", action="store_true",
+                        default=os.getenv("WARMUP", "").lower() in ("1", "true", "yes"),
+                        help="启动时预加载全部解析与 OCR 依赖（适合常驻的 SSE 部署）")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVER_WORKERS") or 1),
+                        help="解析进程数；大于 1 时同一文件的请求固定分派到同一进程（适合多核的 SSE 部署）")
     args = parser.parse_args()
-    EbookService().run(transport=args.mode, port=args.port)
\ No newline at end of file
+    EbookService().run(transport=args.mode, port=args.port, warmup=args.warmup, workers=args.workers)
\ No newline at end of file
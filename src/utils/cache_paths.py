@@ -0,0 +1,30 @@
+import os
+import tempfile
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def get_cache_dir(name: str) -> Path:
+    """返回（并创建）本服务的持久化缓存子目录"""
+    root = os.getenv('READBOOKS_CACHE_DIR') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'mcp-readbooks')
+    path = Path(root) / name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def write_atomic(path: Path, text: str):
+    """先写同目录下的唯一临时文件再原子替换：并发写同一目标的线程/进程互不干扰，读者不会读到半截内容"""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
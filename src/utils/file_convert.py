@@ -1,22 +1,33 @@
-from docx2pdf import convert
+import functools
+import importlib.util
 import subprocess
 from dotenv import load_dotenv
+import logging
 import os
+import queue
+import threading
+import time
+from utils.cache_paths import get_cache_dir
+from utils.fingerprint import file_fingerprint
+from utils.metrics import metrics
 
 # 加载 .env 文件
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# 进程内进行中的转换：key -> threading.Event
+_inflight = {}
+_inflight_lock = threading.Lock()
+# 跨进程锁文件超过该时长视为残留
+_STALE_LOCK_SECONDS = 30 * 60
+
+
 def convert_to_pdf(doc_path):
     try:
-        pdf_path = doc_path.rsplit('.', 1)[0] + '.pdf'
-        if os.path.exists(pdf_path):
-            print(f"PDF文件已存在: {pdf_path}")
-            return pdf_path
-
-        convert(doc_path, pdf_path) 
-        return pdf_path
+        return _cached_convert(doc_path, 'pdf', _run_docx2pdf)
     except Exception as e:
-        print(f"Word转换失败: {str(e)}")
+        logger.error(f"Word转换失败: {str(e)}")
         return None
 
 def convert_ebook(ebook_path, output_format='pdf'):
@@ -29,38 +40,203 @@ def convert_ebook(ebook_path, output_format='pdf'):
         转换后的文件路径或None
     """
     if output_format.lower() not in ['pdf', 'epub']:
-        print("输出格式必须是'pdf'或'epub'")
+        logger.error("输出格式必须是'pdf'或'epub'")
         return None
 
     ext = ebook_path.rsplit('.', 1)[-1].lower() if '.' in ebook_path else ''
     if ext not in ['chm', 'mobi']:
-        print("仅支持CHM或MOBI格式输入")
+        logger.error("仅支持CHM或MOBI格式输入")
         return None
 
-    output_path = ebook_path.rsplit('.', 1)[0] + f'.{output_format.lower()}'
-    if os.path.exists(output_path):
-        print(f"输出文件已存在: {output_path}")
-        return output_path
-
     # 从 .env 文件中获取 ebook-convert 路径
     ebook_convert_path = os.getenv('EBOOK_CONVERT_PATH')
     if not ebook_convert_path:
-        print("未在 .env 文件中找到 EBOOK_CONVERT_PATH，请检查。")
+        logger.error("未在 .env 文件中找到 EBOOK_CONVERT_PATH，请检查。")
         return None
 
     try:
-        args = [ebook_convert_path, ebook_path, output_path]
-        if output_format == 'pdf':
-            args.append('--pdf-add-toc')  # 添加PDF目录书签
-        subprocess.run(args, check=True, 
-                      stdout=subprocess.PIPE, 
-                      stderr=subprocess.PIPE)
-        return output_path
+        return _cached_convert(ebook_path, output_format.lower(), _run_calibre)
     except subprocess.CalledProcessError as e:
         err_msg = e.stderr.decode('utf-8', 'ignore') if e.stderr else ''
-        print(f"转换失败: {err_msg}")
+        logger.error(f"转换失败: {err_msg}")
     except FileNotFoundError:
-        print(f"未找到指定的 ebook-convert 路径: {ebook_convert_path}，请检查 .env 文件。")
+        logger.error(f"未找到指定的 ebook-convert 路径: {ebook_convert_path}，请检查 .env 文件。")
     except Exception as e:
-        print(f"未知错误: {str(e)}")
-    return None
\ No newline at end of file
+        logger.error(f"未知错误: {str(e)}")
+    return None
+
+def _run_docx2pdf(src_path, output_path):
+    from docx2pdf import convert  # 仅 Word 转换用到，延迟导入
+    convert(src_path, output_path)
+
+def _run_calibre(src_path, output_path):
+    args = [os.getenv('EBOOK_CONVERT_PATH'), src_path, output_path]
+    if output_path.endswith('.pdf'):
+        args.append('--pdf-add-toc')  # 添加PDF目录书签
+    subprocess.run(args, check=True,
+                  stdout=subprocess.PIPE,
+                  stderr=subprocess.PIPE)
+
+def _cached_convert(src_path, output_format, runner):
+    """
+    转换结果存放在缓存目录，以源文件内容哈希为键；
+    同一文件的并发请求只执行一次转换，其余等待其结果
+    """
+    cache_dir = get_cache_dir('convert')
+    key = f"{file_fingerprint(src_path)}.{output_format}"
+    output_path = str(cache_dir / key)
+    if os.path.exists(output_path):
+        os.utime(output_path)  # 刷新访问时间，供 LRU 淘汰
+        metrics.cache_result('convert', True)
+        return output_path
+    metrics.cache_result('convert', False)
+
+    with _inflight_lock:
+        event = _inflight.get(key)
+        leader = event is None
+        if leader:
+            event = _inflight[key] = threading.Event()
+    if not leader:
+        event.wait()
+        if os.path.exists(output_path):
+            return output_path
+        raise RuntimeError(f"并发转换失败: {src_path}")
+
+    try:
+        with metrics.span('convert', format=output_format):
+            _convert_once(src_path, output_path, runner)
+        _evict(cache_dir, keep=output_path)
+        return output_path
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        event.set()
+
+def _convert_once(src_path, output_path, runner):
+    """跨进程去重：持有锁文件者执行转换，其他进程轮询等待"""
+    lock_path = output_path + '.lock'
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > _STALE_LOCK_SECONDS:
+                    os.remove(lock_path)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(0.5)
+            if os.path.exists(output_path):
+                return
+    try:
+        os.close(fd)
+        if os.path.exists(output_path):
+            return
+        stem, ext = os.path.splitext(output_path)
+        tmp_path = f"{stem}.tmp-{os.getpid()}-{threading.get_ident()}{ext}"
+        try:
+            runner(src_path, tmp_path)
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    finally:
+        os.remove(lock_path)
+
+def _evict(cache_dir, keep=None):
+    """缓存目录超出 CONVERT_CACHE_MAX_MB 时按最久未使用删除"""
+    max_bytes = int(float(os.getenv('CONVERT_CACHE_MAX_MB', 2048)) * 1024 * 1024)
+    files = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and '.tmp-' not in entry.name and not entry.name.endswith('.lock'):
+            st = entry.stat()
+            files.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+@functools.lru_cache(maxsize=None)
+def _module_available(name):
+    """进程内结果不变，避免扫描书库时逐个文件查找模块"""
+    return importlib.util.find_spec(name) is not None
+
+
+class PreconvertQueue:
+    """
+    后台预转换队列：新书库在首次阅读前完成格式转换
+
+    DOCX/MOBI/CHM 在对应库（python-docx/mobi/pychm）可用时直接读取（见 core.native_extractors），
+    只有 .doc 与缺少读取库的格式才需要预先转换
+    """
+    EXTENSIONS = ('.doc', '.docx', '.chm', '.mobi')
+    NATIVE_MODULES = {'.docx': 'docx', '.mobi': 'mobi', '.chm': 'chm'}
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def enqueue_library(self, directory):
+        """递归扫描目录并将需要转换的文件加入队列，返回入队数量；会阻塞，勿在事件循环中调用"""
+        count = 0
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if self.needs_conversion(name):
+                    self.enqueue(os.path.join(root, name))
+                    count += 1
+        return count
+
+    def scan_library(self, directory):
+        """由后台转换线程扫描目录后入队，调用方不等待（服务启动时使用）"""
+        self.enqueue(directory)
+
+    @classmethod
+    def needs_conversion(cls, path):
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in cls.EXTENSIONS:
+            return False
+        module = cls.NATIVE_MODULES.get(ext)
+        return module is None or not _module_available(module)
+
+    def enqueue(self, path):
+        with self._lock:
+            self._queue.put(path)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name='preconvert', daemon=True)
+                self._thread.start()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _worker(self):
+        while True:
+            try:
+                path = self._queue.get(timeout=5)
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+            try:
+                if os.path.isdir(path):
+                    count = self.enqueue_library(path)
+                    logger.info(f"书库预转换入队 {count} 个文件，目录: {path}")
+                elif path.lower().endswith(('.doc', '.docx')):
+                    convert_to_pdf(path)
+                else:
+                    convert_ebook(path)
+            except Exception as e:
+                logger.warning(f"预转换失败 {path}: {str(e)}")
+            finally:
+                self._queue.task_done()
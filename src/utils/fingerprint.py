@@ -0,0 +1,25 @@
+import hashlib
+import os
+import threading
+
+_memo = {}
+_lock = threading.Lock()
+
+
+def file_fingerprint(path: str) -> str:
+    """文件内容指纹（BLAKE2b），按路径+mtime/size 在进程内记忆"""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _lock:
+        memo = _memo.get(path)
+        if memo and memo[0] == stamp:
+            return memo[1]
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _lock:
+        _memo[path] = (stamp, digest)
+    return digest
@@ -0,0 +1,200 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+# 耗时直方图桶上限（秒），覆盖缓存命中到整页 OCR 的量级
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_HELP = {
+    'readbooks_stage_duration_seconds': '各处理阶段耗时',
+    'readbooks_stage_errors_total': '各处理阶段异常次数',
+    'readbooks_cache_requests_total': '缓存查询次数（按结果）',
+    'readbooks_queue_wait_seconds': '解析任务排队等待时间',
+    'readbooks_task_duration_seconds': '解析任务总耗时（不含排队）',
+    'readbooks_tasks_total': '解析任务次数（按结果）',
+    'readbooks_ocr_plans_total': 'PDF 页 OCR 方式（skip/page/blocks）',
+    'readbooks_ocr_images_total': 'OCR 图像处理结果（识别/命中缓存/过小跳过）',
+    'readbooks_prefetch_pages_total': '顺序预读提前提取的页数',
+    'readbooks_prefetch_jobs_total': '顺序预读任务结果（完成/取消/超出预算）',
+    'readbooks_worker_up': '解析进程是否存活且心跳正常（多进程模式）',
+    'readbooks_worker_in_flight': '已分派到解析进程尚未完成的任务数',
+    'readbooks_worker_tasks_total': '解析进程累计完成的任务数（按结果）',
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+
+class MetricsRegistry:
+    """进程内计数器、瞬时值与直方图，可导出为 Prometheus 文本格式或 dict"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels: dict) -> LabelKey:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def set_total(self, name: str, value: float, **labels):
+        """直接设置计数器的值：用于在别处累计的单调计数（如主进程记录的各解析进程任务数）"""
+        key = self._key(labels)
+        with self._lock:
+            self._counters.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist.counts[i] += 1
+                    break
+            hist.sum += value
+            hist.count += 1
+
+    @contextmanager
+    def span(self, stage: str, **labels):
+        """记录一个处理阶段的耗时；异常时另计错误次数并继续抛出"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc('readbooks_stage_errors_total', stage=stage, **labels)
+            raise
+        finally:
+            self.observe('readbooks_stage_duration_seconds',
+                         time.perf_counter() - start, stage=stage, **labels)
+
+    def cache_result(self, cache: str, hit: bool):
+        self.inc('readbooks_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+    def dump(self) -> dict:
+        """
+        原始数据，可序列化后跨进程传递：{'counters'|'gauges'|'histograms': {指标名: {标签键: 值}}}，
+        直方图的值为 (各桶计数, 总和, 次数)
+        """
+        with self._lock:
+            return {
+                'counters': {name: dict(series) for name, series in self._counters.items()},
+                'gauges': {name: dict(series) for name, series in self._gauges.items()},
+                'histograms': {
+                    name: {key: (list(h.counts), h.sum, h.count) for key, h in series.items()}
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def snapshot(self) -> dict:
+        """按指标名汇总：计数器与瞬时值为 {标签: 值}，直方图为 {标签: {count, sum, avg, p50, p95}}"""
+        return self.summarize(self.dump())
+
+    def summarize(self, data: dict) -> dict:
+        """把 dump() 的原始数据汇总为 snapshot() 的格式（也用于解析进程上报的数据）"""
+        result = {}
+        for kind in ('counters', 'gauges'):
+            for name, series in data[kind].items():
+                result[name] = {self._label_text(key): value for key, value in series.items()}
+        for name, series in data['histograms'].items():
+            result[name] = {
+                self._label_text(key): {
+                    'count': count,
+                    'sum': round(total, 6),
+                    'avg': round(total / count, 6) if count else 0.0,
+                    'p50': self._quantile(counts, count, 0.5),
+                    'p95': self._quantile(counts, count, 0.95),
+                }
+                for key, (counts, total, count) in series.items()
+            }
+        return result
+
+    def _quantile(self, counts, count, q) -> Optional[float]:
+        """按桶估计分位数（返回所在桶的上限）；落在最大桶之外时无法估计，返回 None（JSON 中为 null）"""
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for bound, n in zip(self.buckets, counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return None
+
+    def render_prometheus(self, remote: Iterable[Tuple[dict, dict]] = ()) -> str:
+        """
+        导出为 Prometheus 文本格式；remote 为其他进程的 (附加标签, dump() 数据)，
+        与本进程的指标合并输出（多进程模式下各解析进程以 worker 标签区分）
+        """
+        merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+        for labels, data in [({}, self.dump()), *remote]:
+            extra = self._key(labels)
+            for kind, families in data.items():
+                for name, series in families.items():
+                    target = merged[kind].setdefault(name, {})
+                    for key, value in series.items():
+                        target[tuple(sorted(key + extra))] = value
+        lines = []
+        for kind, type_name in (('counters', 'counter'), ('gauges', 'gauge')):
+            for name, series in sorted(merged[kind].items()):
+                lines.append(f'# HELP {name} {_HELP.get(name, name)}')
+                lines.append(f'# TYPE {name} {type_name}')
+                for key, value in series.items():
+                    lines.append(f'{name}{self._label_text(key)} {value:g}')
+        for name, series in sorted(merged['histograms'].items()):
+            lines.append(f'# HELP {name} {_HELP.get(name, name)}')
+            lines.append(f'# TYPE {name} histogram')
+            for key, (counts, total, count) in series.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{self._label_text(key + (("le", f"{bound:g}"),))} {cumulative}')
+                lines.append(f'{name}_bucket{self._label_text(key + (("le", "+Inf"),))} {count}')
+                lines.append(f'{name}_sum{self._label_text(key)} {total:.6f}')
+                lines.append(f'{name}_count{self._label_text(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _label_text(key: LabelKey) -> str:
+        if not key:
+            return ''
+        pairs = ','.join(
+            '{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for k, v in key
+        )
+        return '{' + pairs + '}'
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+# 进程级单例；并行解析的工作进程各自统计，不回传主进程。
+# 多进程服务模式下各解析进程随心跳上报原始数据，由主进程汇总进 server_stats 与 /metrics
+metrics = MetricsRegistry()